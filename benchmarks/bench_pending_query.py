@@ -0,0 +1,126 @@
+"""待推送查询基准测试
+
+在临时数据库中逐步写入已推送的历史消息（默认写到 1000 万行），每到一个检查点
+再写入一批新消息，分别测量：
+
+- 旧版 get_messages(is_pushed=False) 使用的查询（不使用部分索引）
+- iter_messages(is_pushed=False) 的第一页
+- claim_deliveries 首次领取（包含拆分新消息）和后续每页领取
+
+用于确认部分索引和游标分页下，查询耗时不随历史数据增长。
+
+用法（在项目根目录执行）：
+    python benchmarks/bench_pending_query.py --rows 10000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+
+ADMIN_ID = 1
+# 旧版查询，NOT INDEXED 模拟没有部分索引时的执行方式
+LEGACY_QUERY = "SELECT * FROM messages NOT INDEXED WHERE is_pushed = ? ORDER BY message_date DESC LIMIT 100"
+START_DATE = datetime(2024, 1, 1)
+
+
+def message_rows(start: int, stop: int, is_pushed: int):
+    """生成测试消息"""
+    for i in range(start, stop):
+        yield (
+            1, random.randrange(1000), random.randrange(100000), i,
+            "出售" + "x" * random.randrange(20, 200), "出售", "fuzzy",
+            (START_DATE + timedelta(seconds=i)).isoformat(), is_pushed, 0, 0
+        )
+
+
+def fill_history(conn: sqlite3.Connection, start: int, stop: int, chunk: int = 100000) -> None:
+    """写入已推送的历史消息及其已送达的推送任务"""
+    for offset in range(start, stop, chunk):
+        end = min(offset + chunk, stop)
+        with conn:
+            cursor = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages")
+            first_id = cursor.fetchone()[0] + 1
+            conn.executemany(db.INSERT_MESSAGE_SQL, message_rows(offset, end, 1))
+            conn.execute(
+                "INSERT INTO deliveries (message_rowid, admin_id, state) "
+                "SELECT id, ?, 'sent' FROM messages WHERE id >= ?",
+                (ADMIN_ID, first_id)
+            )
+
+
+def timed(func, repeat: int = 5) -> float:
+    """多次执行取中位数，单位毫秒"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def measure(conn: sqlite3.Connection, total: int, pending: int) -> dict:
+    """写入一批新消息并测量各查询耗时"""
+    with conn:
+        conn.executemany(db.INSERT_MESSAGE_SQL, message_rows(total, total + pending, 0))
+
+    result = {
+        "legacy": timed(lambda: conn.execute(LEGACY_QUERY, (0,)).fetchall()),
+        "iter": timed(lambda: list(islice(db.iter_messages(is_pushed=False, page_size=100), 100))),
+    }
+
+    start = time.perf_counter()
+    db.claim_deliveries([ADMIN_ID], 100, 600)
+    result["claim_first"] = (time.perf_counter() - start) * 1000
+    result["claim_page"] = timed(lambda: db.claim_deliveries([ADMIN_ID], 100, 600))
+
+    # 清空待推送任务，恢复到只有历史数据的状态
+    with conn:
+        conn.execute("UPDATE deliveries SET state = 'sent' WHERE state != 'sent'")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="历史消息总行数")
+    parser.add_argument("--pending", type=int, default=1000, help="每个检查点写入的新消息数")
+    parser.add_argument("--db", help="数据库路径，默认使用临时目录")
+    args = parser.parse_args()
+
+    random.seed(0)
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="bench_"), "messages.db")
+    db.close_db()
+    db.DB_PATH = db_path
+    db.init_db()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous = OFF")
+
+    checkpoints = sorted({n for n in (10_000, 100_000, 1_000_000, 10_000_000) if n < args.rows} | {args.rows})
+    print(f"数据库: {db_path}")
+    print(f"{'历史行数':>12} {'旧查询(ms)':>12} {'游标首页(ms)':>14} {'首次领取(ms)':>14} {'领取一页(ms)':>14}")
+
+    total = 0
+    for checkpoint in checkpoints:
+        fill_history(conn, total, checkpoint)
+        total = checkpoint
+        r = measure(conn, total, args.pending)
+        total += args.pending
+        print(f"{checkpoint:>12,} {r['legacy']:>12.2f} {r['iter']:>14.2f} {r['claim_first']:>14.2f} {r['claim_page']:>14.2f}")
+
+    conn.close()
+    db.close_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""采集到推送全链路基准测试
+
+不连接 Telegram，用 benchmarks/fake.py 中的假客户端和合成消息，依次测量：
+
+- match：match_keywords 单条耗时
+- handler：on_group_message 单条耗时（会话规则、去重、匹配、入写入队列）
+- drain：写线程把队列中的消息全部落库的时间
+- push：push_task 每批耗时（使用假的 send_message），--digest 时按汇总方式推送，
+  --backlog 时超过上限的低优先级任务被跳过
+- save_message：同步单条写入耗时
+
+输出每个阶段的 p50/p99、吞吐量和进程内存峰值，并把结果保存为 JSON，
+可以用 --compare 与之前版本的结果对比。
+
+用法（在项目根目录执行，需要安装 requirements.txt 中的依赖）：
+    python benchmarks/bench_pipeline.py --messages 50000 --keywords 1000 --hit-rate 0.05
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/<之前的结果>.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+os.environ.setdefault("ADMIN_ID", "1")
+
+import db  # noqa: E402
+import metrics  # noqa: E402
+import bot.push as push  # noqa: E402
+import user.messages as messages  # noqa: E402
+from bot.ratelimit import RateLimiter  # noqa: E402
+from config import save_json  # noqa: E402
+from keywords import KeywordStore  # noqa: E402
+from fake import FakeClient, MessageFactory, make_keywords, make_message  # noqa: E402
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """耗时样本（秒）的统计，结果单位毫秒"""
+    if not samples:
+        return {"count": 0}
+    if len(samples) == 1:
+        p50 = p99 = samples[0]
+    else:
+        quantiles = statistics.quantiles(samples, n=100, method="inclusive")
+        p50, p99 = quantiles[49], quantiles[98]
+    return {
+        "count": len(samples),
+        "p50_ms": p50 * 1000,
+        "p99_ms": p99 * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "total_s": sum(samples),
+    }
+
+
+def max_rss_mb() -> float:
+    """进程内存峰值（MB）"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位是 KB，macOS 是字节
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def git_label() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "local"
+
+
+def setup(workdir: str, keywords: List[str], fuzzy_ratio: float, rng: random.Random) -> None:
+    """使用临时数据库和关键词文件"""
+    db.close_db()
+    db.DB_PATH = os.path.join(workdir, "messages.db")
+    db.init_db()
+    db.load_blacklist()
+
+    fuzzy_count = int(len(keywords) * fuzzy_ratio)
+    shuffled = keywords[:]
+    rng.shuffle(shuffled)
+    keywords_file = Path(workdir) / "keywords.json"
+    save_json(keywords_file, {"exact": shuffled[fuzzy_count:], "fuzzy": shuffled[:fuzzy_count]})
+    messages.keyword_store = KeywordStore(keywords_file)
+    messages.keyword_store.load()
+
+
+async def run(args) -> Dict:
+    rng = random.Random(args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    keywords = make_keywords(args.keywords, rng)
+    setup(workdir, keywords, args.fuzzy_ratio, rng)
+
+    # 推送默认不限速，只测量本地开销；--rate-limit 时使用正式的限速参数
+    if not args.rate_limit:
+        push.rate_limiter = RateLimiter(1e9, 1e9, 1e9)
+    # 汇总推送不等待时间窗口，只测量合并的效果
+    push.DIGEST_BY = args.digest
+    push.PUSH_DIGEST_WINDOW = 0
+    push.BACKLOG_LIMIT = args.backlog
+
+    factory = MessageFactory(
+        keywords, args.hit_rate,
+        length_median=args.length_median, length_sigma=args.length_sigma,
+        chats=args.chats, seed=args.seed
+    )
+    batch = factory.messages(args.messages)
+    listener = FakeClient("user_bench", user_id=1000)
+    bot = FakeClient("bot", user_id=1, send_latency=args.send_latency)
+    results: Dict[str, Dict] = {}
+
+    # 1. 关键词匹配
+    matcher = messages.keyword_store.snapshot.matcher
+    samples = []
+    hits = 0
+    for message in batch:
+        started = time.perf_counter()
+        match = messages.match_keywords(message.text, matcher)
+        samples.append(time.perf_counter() - started)
+        hits += match is not None
+    results["match"] = summarize(samples)
+    results["match"]["hits"] = hits
+
+    # 2. 消息处理（写入队列由写线程异步落库）
+    db.message_writer.start()
+    samples = []
+    began = time.perf_counter()
+    for message in batch:
+        started = time.perf_counter()
+        await messages.on_group_message(listener, message)
+        samples.append(time.perf_counter() - started)
+    handler_elapsed = time.perf_counter() - began
+    results["handler"] = summarize(samples)
+    results["handler"]["messages_per_s"] = len(batch) / handler_elapsed
+
+    # 3. 等写线程写完
+    started = time.perf_counter()
+    db.message_writer.stop()
+    drain = time.perf_counter() - started
+    results["drain"] = {"total_s": drain}
+    results["ingest"] = {"messages_per_s": len(batch) / (handler_elapsed + drain)}
+
+    # 4. 推送
+    samples = []
+    deliveries = 0
+    began = time.perf_counter()
+    while True:
+        started = time.perf_counter()
+        claimed = await push.push_task(bot)
+        if not claimed:
+            break
+        samples.append(time.perf_counter() - started)
+        deliveries += claimed
+    push_elapsed = time.perf_counter() - began
+    results["push"] = summarize(samples)
+    results["push"]["deliveries"] = deliveries
+    results["push"]["sent"] = len(bot.sent)
+    results["push"]["shed"] = int(metrics.push_shed.value())
+    results["push"]["deliveries_per_s"] = deliveries / push_elapsed if push_elapsed else 0
+
+    # 5. 同步单条写入
+    samples = []
+    for i in range(args.save_samples):
+        message = make_message(-2000000000000, i + 1, factory.text(), sender_id=1)
+        fields = dict(
+            client_id=listener.me.id,
+            chat_id=message.chat.id,
+            chat_title=message.chat.title,
+            chat_type=message.chat.type.value,
+            chat_username=None,
+            sender_id=message.from_user.id,
+            sender_username=message.from_user.username,
+            sender_name=message.from_user.full_name,
+            message_id=message.id,
+            message_text=message.text,
+            matched_keyword="bench",
+            match_type="fuzzy",
+            message_date=message.date
+        )
+        started = time.perf_counter()
+        db.save_message(**fields)
+        samples.append(time.perf_counter() - started)
+    results["save_message"] = summarize(samples)
+
+    db.close_db()
+    return {
+        "label": args.label or git_label(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "params": {
+            "messages": args.messages,
+            "keywords": args.keywords,
+            "fuzzy_ratio": args.fuzzy_ratio,
+            "hit_rate": args.hit_rate,
+            "length_median": args.length_median,
+            "length_sigma": args.length_sigma,
+            "chats": args.chats,
+            "send_latency": args.send_latency,
+            "rate_limit": args.rate_limit,
+            "digest": args.digest,
+            "backlog": args.backlog,
+            "seed": args.seed,
+        },
+        "max_rss_mb": max_rss_mb(),
+        "stages": results,
+        "workdir": workdir,
+    }
+
+
+def print_report(report: Dict) -> None:
+    stages = report["stages"]
+    print(f"版本: {report['label']}  时间: {report['timestamp']}")
+    print(f"参数: {json.dumps(report['params'], ensure_ascii=False)}")
+    print(f"{'阶段':<14} {'次数':>10} {'p50(ms)':>10} {'p99(ms)':>10}")
+    for name in ("match", "handler", "push", "save_message"):
+        stage = stages[name]
+        if stage.get("count"):
+            print(f"{name:<14} {stage['count']:>10,} {stage['p50_ms']:>10.4f} {stage['p99_ms']:>10.4f}")
+    print(f"匹配命中: {stages['match']['hits']:,}")
+    print(f"处理吞吐: {stages['handler']['messages_per_s']:,.0f} 条/秒")
+    print(f"写库排空: {stages['drain']['total_s']:.3f} 秒，采集吞吐（含落库）: {stages['ingest']['messages_per_s']:,.0f} 条/秒")
+    print(f"推送: {stages['push']['deliveries']:,} 个任务，{stages['push']['deliveries_per_s']:,.0f} 个/秒，"
+          f"发出 {stages['push']['sent']:,} 条消息，积压跳过 {stages['push'].get('shed', 0):,} 个任务")
+    print(f"内存峰值: {report['max_rss_mb']:.1f} MB")
+
+
+def print_comparison(old: Dict, new: Dict) -> None:
+    """与之前的结果逐项对比，比值 < 1 表示变快"""
+    print(f"\n对比 {old['label']} ({old['timestamp']}) -> {new['label']}")
+    if old["params"] != new["params"]:
+        print("⚠️ 两次测试参数不同，对比仅供参考")
+    for name in ("match", "handler", "push", "save_message"):
+        before, after = old["stages"].get(name, {}), new["stages"].get(name, {})
+        if not before.get("count") or not after.get("count"):
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            ratio = after[key] / before[key] if before[key] else float("inf")
+            print(f"{name:<14} {key:<7} {before[key]:>10.4f} -> {after[key]:>10.4f}  x{ratio:.2f}")
+    before, after = old["stages"]["ingest"]["messages_per_s"], new["stages"]["ingest"]["messages_per_s"]
+    print(f"{'ingest':<14} {'条/秒':<7} {before:>10,.0f} -> {after:>10,.0f}  x{after / before:.2f}")
+    print(f"{'memory':<14} {'MB':<7} {old['max_rss_mb']:>10.1f} -> {new['max_rss_mb']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000, help="合成消息数量")
+    parser.add_argument("--keywords", type=int, default=500, help="关键词数量")
+    parser.add_argument("--fuzzy-ratio", type=float, default=0.8, help="模糊匹配关键词的比例")
+    parser.add_argument("--hit-rate", type=float, default=0.02, help="消息包含关键词的概率")
+    parser.add_argument("--length-median", type=float, default=80, help="文本长度中位数")
+    parser.add_argument("--length-sigma", type=float, default=1.0, help="文本长度对数正态分布的 sigma")
+    parser.add_argument("--chats", type=int, default=200, help="群组数量")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="假 send_message 的延迟（秒）")
+    parser.add_argument("--rate-limit", action="store_true", help="推送使用正式的限速参数")
+    parser.add_argument("--digest", choices=("keyword", "chat"), help="按关键词或会话汇总推送")
+    parser.add_argument("--backlog", type=int, default=0, help="每个管理员的推送积压上限，0 表示不限制")
+    parser.add_argument("--save-samples", type=int, default=2000, help="同步单条写入的测量次数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", help="结果标签，默认使用当前 git 提交")
+    parser.add_argument("--workdir", help="数据库和关键词文件目录，默认使用临时目录")
+    parser.add_argument("--output", help="结果文件，默认保存到 benchmarks/results/")
+    parser.add_argument("--compare", help="与之前保存的结果对比")
+    args = parser.parse_args()
+
+    # 逐条的匹配日志会干扰测量
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    output = Path(args.output) if args.output else (
+        RESULTS_DIR / f"pipeline-{report['label']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"\n结果已保存: {output}")
+
+    if args.compare:
+        print_comparison(json.loads(Path(args.compare).read_text()), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""基准测试用的假客户端和合成消息
+
+不连接 Telegram：FakeClient 代替监听号和推送机器人，make_message 生成
+on_group_message 用到的消息字段，MessageFactory 按关键词数量、文本长度分布
+和命中率生成群消息。
+"""
+import asyncio
+import random
+import string
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import List, Optional, Sequence, Tuple
+
+# 生成文本用的字符：常用汉字加字母数字
+_CJK = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经"
+_ALPHABET = _CJK + string.ascii_letters + string.digits + "  "
+# 关键词使用另一组汉字，保证命中率只由 hit_rate 决定
+_KEYWORD_CHARS = "售卖买价钱租招聘代办理贷款兼职刷单返利优惠充值换汇担保出入金现结日结包赔"
+
+
+class FakeClient:
+    """代替 pyrogram.Client 的最小实现：监听号只需要 name、me，推送只需要 send_message"""
+
+    def __init__(self, name: str = "user_bench", user_id: int = 1000, send_latency: float = 0.0):
+        self.name = name
+        self.me = SimpleNamespace(id=user_id, is_self=True)
+        self.is_connected = True
+        self.send_latency = send_latency
+        self.sent: List[Tuple[int, float]] = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        """模拟发送：可选的固定延迟，并记录发送时间"""
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.sent.append((chat_id, time.perf_counter()))
+        return SimpleNamespace(id=len(self.sent), chat=SimpleNamespace(id=chat_id), text=text)
+
+
+def make_message(chat_id: int, message_id: int, text: str, sender_id: Optional[int] = None,
+                 chat_type: str = "supergroup", date: Optional[datetime] = None):
+    """构造 on_group_message 读取的消息对象"""
+    chat = SimpleNamespace(
+        id=chat_id,
+        type=SimpleNamespace(value=chat_type),
+        title=f"测试群组 {chat_id}",
+        username=None
+    )
+    sender = None
+    if sender_id is not None:
+        sender = SimpleNamespace(
+            id=sender_id,
+            is_self=False,
+            username=f"user{sender_id}",
+            full_name=f"测试用户 {sender_id}"
+        )
+    return SimpleNamespace(
+        id=message_id,
+        chat=chat,
+        from_user=sender,
+        text=text,
+        caption=None,
+        date=date or datetime.now()
+    )
+
+
+def make_keywords(count: int, rng: random.Random, min_length: int = 2, max_length: int = 6) -> List[str]:
+    """生成互不相同的随机关键词"""
+    keywords = set()
+    while len(keywords) < count:
+        length = rng.randint(min_length, max_length)
+        keywords.add("".join(rng.choice(_KEYWORD_CHARS) for _ in range(length)))
+    return sorted(keywords)
+
+
+class MessageFactory:
+    """按给定分布生成合成群消息
+
+    文本长度服从对数正态分布（中位数 length_median），
+    以 hit_rate 的概率在随机位置插入一个关键词。
+    """
+
+    def __init__(self, keywords: Sequence[str], hit_rate: float, length_median: float = 80,
+                 length_sigma: float = 1.0, chats: int = 100, senders: int = 10000, seed: int = 0):
+        self.keywords = list(keywords)
+        self.hit_rate = hit_rate
+        self.length_median = length_median
+        self.length_sigma = length_sigma
+        self.chats = chats
+        self.senders = senders
+        self.rng = random.Random(seed)
+        self._next_id = 0
+
+    def text(self) -> str:
+        rng = self.rng
+        length = max(1, int(rng.lognormvariate(0, self.length_sigma) * self.length_median))
+        text = "".join(rng.choice(_ALPHABET) for _ in range(length))
+        if self.keywords and rng.random() < self.hit_rate:
+            position = rng.randrange(len(text) + 1)
+            text = text[:position] + rng.choice(self.keywords) + text[position:]
+        return text
+
+    def message(self):
+        self._next_id += 1
+        return make_message(
+            chat_id=-1000000000000 - self.rng.randrange(self.chats),
+            message_id=self._next_id,
+            text=self.text(),
+            sender_id=self.rng.randrange(1, self.senders + 1)
+        )
+
+    def messages(self, count: int) -> list:
+        return [self.message() for _ in range(count)]
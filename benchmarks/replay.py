@@ -0,0 +1,138 @@
+"""回放录制的群消息
+
+读取 recorder 写下的分段文件（RECORD_UPDATES=true 时生成），按收到时间顺序
+交给 user/messages.py 的 on_group_message 处理，不连接 Telegram。
+匹配结果写入临时数据库，结束后输出处理耗时、吞吐量和落后于录制节奏的最大时间。
+
+用法（在项目根目录执行，需要安装 requirements.txt 中的依赖）：
+    python benchmarks/replay.py data/recordings              # 尽快回放
+    python benchmarks/replay.py data/recordings --speed 1    # 按录制时的节奏
+    python benchmarks/replay.py data/recordings --speed 10   # 10 倍速
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+os.environ.setdefault("ADMIN_ID", "1")
+
+import db  # noqa: E402
+import user.messages as messages  # noqa: E402
+from config import KEYWORDS_FILE  # noqa: E402
+from keywords import KeywordStore  # noqa: E402
+from recorder import read_records  # noqa: E402
+from fake import FakeClient  # noqa: E402
+
+
+def message_from_record(record: Dict):
+    """把录制的记录还原为 on_group_message 读取的消息对象"""
+    chat = SimpleNamespace(
+        id=record['chat_id'],
+        type=SimpleNamespace(value=record['chat_type']),
+        title=record['chat_title'],
+        username=record['chat_username']
+    )
+    sender = None
+    if record['sender_id'] is not None:
+        sender = SimpleNamespace(
+            id=record['sender_id'],
+            is_self=record['sender_is_self'],
+            username=record['sender_username'],
+            full_name=record['sender_name']
+        )
+    return SimpleNamespace(
+        id=record['message_id'],
+        chat=chat,
+        from_user=sender,
+        text=record['text'],
+        caption=record['caption'],
+        date=datetime.fromtimestamp(record['date']) if record['date'] else None
+    )
+
+
+async def replay(args) -> None:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="replay_")
+    db.close_db()
+    db.DB_PATH = os.path.join(workdir, "messages.db")
+    db.init_db()
+    db.load_blacklist()
+    messages.keyword_store = KeywordStore(Path(args.keywords_file))
+    messages.keyword_store.load()
+    db.message_writer.start()
+
+    clients: Dict[str, FakeClient] = {}
+    samples = []
+    behind = 0.0
+    first_recv = None
+    began = time.monotonic()
+
+    records = read_records(args.paths)
+    if args.limit:
+        records = islice(records, args.limit)
+
+    for record in records:
+        # 按录制时的间隔（除以倍速）等待，跟不上时记录落后的时间
+        if args.speed > 0:
+            if first_recv is None:
+                first_recv = record['recv']
+            delay = began + (record['recv'] - first_recv) / args.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                behind = max(behind, -delay)
+
+        client = clients.get(record['client'])
+        if client is None:
+            client = clients[record['client']] = FakeClient(record['client'], user_id=record['client_id'])
+
+        started = time.perf_counter()
+        await messages.on_group_message(client, message_from_record(record))
+        samples.append(time.perf_counter() - started)
+
+    elapsed = time.monotonic() - began
+    db.message_writer.stop()
+    with db.read_conn() as conn:
+        saved = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    db.close_db()
+
+    if not samples:
+        print("没有可回放的记录")
+        return
+
+    quantiles = statistics.quantiles(samples, n=100, method="inclusive") if len(samples) > 1 else samples * 99
+    print(f"回放 {len(samples):,} 条消息，{len(clients)} 个监听号，耗时 {elapsed:.2f} 秒")
+    print(f"吞吐: {len(samples) / elapsed:,.0f} 条/秒")
+    print(f"处理耗时: p50 {quantiles[49] * 1000:.4f}ms，p99 {quantiles[98] * 1000:.4f}ms")
+    if args.speed > 0:
+        print(f"最大落后: {behind:.3f} 秒")
+    print(f"保存的匹配消息: {saved:,} 条（数据库: {db.DB_PATH}）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="分段文件或录制目录")
+    parser.add_argument("--speed", type=float, default=0, help="回放倍速，0 表示尽快回放")
+    parser.add_argument("--limit", type=int, default=0, help="最多回放的条数")
+    parser.add_argument("--keywords-file", default=str(KEYWORDS_FILE), help="关键词文件")
+    parser.add_argument("--workdir", help="数据库目录，默认使用临时目录")
+    args = parser.parse_args()
+
+    # 逐条的匹配日志会干扰测量
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
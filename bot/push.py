@@ -1,18 +1,47 @@
 import asyncio
 import json
+import time
 import logging
-from typing import Dict
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple
 
 from pyrogram import Client
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from db import get_messages, mark_as_pushed, is_user_blocked, block_user
-from config import ADMIN_IDS
+from db import claim_deliveries, finish_deliveries, next_delivery_due, shed_deliveries
+from config import (
+    ADMIN_IDS, PUSH_GLOBAL_RATE, PUSH_CHAT_RATE, PUSH_CHAT_BURST,
+    PUSH_LEASE_SECONDS, PUSH_MAX_ATTEMPTS, PUSH_RETRY_BASE, PUSH_RETRY_MAX,
+    PUSH_DIGEST, PUSH_DIGEST_WINDOW, PUSH_DIGEST_MAX, PUSH_BACKLOG_LIMIT, PUSH_SHED
+)
+from bot.ratelimit import RateLimiter
+import metrics
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-PUSH_INTERVAL = 1  # 每1秒检查一次
+PUSH_SWEEP_INTERVAL = 60  # 兜底扫描间隔，处理崩溃后遗留的未推送消息
+PUSH_BATCH_SIZE = 100
+PUSH_ACK_BATCH = 20  # 推送结果攒够这么多条写一次数据库
+
+# 汇总推送的分组方式，None 表示逐条推送
+DIGEST_BY = None if PUSH_DIGEST == 'off' else PUSH_DIGEST
+DIGEST_TEXT_LIMIT = 4000  # Telegram 单条消息上限 4096 字符，留出余量
+DIGEST_KEYBOARD_ROWS = 5  # 汇总消息最多为几个发送者显示按钮
+DIGEST_MORE_TEXT = "…还有 {count} 条（可用 /search 查看）"  # 汇总放不下的条数
+
+# 每个管理员待推送任务的上限，0 表示不限制
+BACKLOG_LIMIT = PUSH_BACKLOG_LIMIT
+SHED_SUMMARY_KEYWORDS = 20  # 积压摘要最多列出的关键词数
+
+# 发送限速
+rate_limiter = RateLimiter(PUSH_GLOBAL_RATE, PUSH_CHAT_RATE, PUSH_CHAT_BURST)
+
+# 推送协程所在的事件循环和唤醒事件
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
 
 # 匹配类型映射
 MATCH_TYPE_MAP = {
@@ -53,83 +82,281 @@ def get_keyboard(msg: Dict) -> InlineKeyboardMarkup:
     
     return InlineKeyboardMarkup([buttons])
 
+def message_link(msg: Dict) -> Optional[str]:
+    """消息链接，私有群组没有"""
+    return f"https://t.me/{msg['chat_username']}/{msg['message_id']}" if msg['chat_username'] else None
+
+def sender_info(msg: Dict) -> str:
+    """发送者名称和用户名"""
+    info = msg['sender_name'] or '未知'
+    if msg['sender_username']:
+        info += f" (@{msg['sender_username']})"
+    return info
+
+def chat_info(msg: Dict) -> str:
+    """群组名称和用户名"""
+    info = msg['chat_title'] or str(msg['chat_id'])
+    if msg['chat_username']:
+        info += f" (@{msg['chat_username']})"
+    return info
+
 async def format_message(msg: Dict) -> str:
     """格式化消息"""
-    chat_link = f"https://t.me/{msg['chat_username']}/{msg['message_id']}" if msg['chat_username'] else None
+    chat_link = message_link(msg)
     match_type = MATCH_TYPE_MAP.get(msg['match_type'], msg['match_type'])
     
-    # 格式化发送者信息
-    sender_info = msg['sender_name'] or '未知'
-    if msg['sender_username']:
-        sender_info += f" (@{msg['sender_username']})"
-    
-    # 格式化群组信息
-    chat_info = msg['chat_title']
-    if msg['chat_username']:
-        chat_info += f" (@{msg['chat_username']})"
-    
     lines = [
         f"🔍 **关键词**: `{msg['matched_keyword']}` __{match_type}__",
-        f"👥 **来源**: {chat_info}",
-        f"👤 **发送者**: {sender_info}",
+        f"👥 **来源**: {chat_info(msg)}",
+        f"👤 **发送者**: {sender_info(msg)}",
         f"📝 **内容**:  \n <blockquote> {msg['message_text']}</blockquote>\n",
     ]
     
+    # 近似重复的消息合并推送，显示出现次数
+    if msg.get('occurrences', 1) > 1:
+        lines.append(f"🔁 **重复**: {msg['occurrences']} 次")
+    
     if chat_link:
         lines.append(f"🔗 **链接**: {chat_link}")
     
     return "\n".join(lines)
 
-async def push_task(client: Client):
-    """推送任务"""
+def _shorten(text: Optional[str], length: int) -> str:
+    text = ' '.join((text or '').split())
+    return text if len(text) <= length else text[:length - 1] + '…'
+
+async def format_digest(msgs: List[Dict]) -> str:
+    """把同一分组的多条匹配格式化为一条汇总消息，单条时与 format_message 相同"""
+    if len(msgs) == 1:
+        return await format_message(msgs[0])
+
+    first = msgs[0]
+    if DIGEST_BY == 'chat':
+        header = f"📬 **来源**: {chat_info(first)} · {len(msgs)} 条匹配"
+    else:
+        header = f"📬 **关键词**: `{first['matched_keyword']}` · {len(msgs)} 条匹配"
+
+    # 按条数分配每条内容的长度；超出上限时只放得下的整条，剩余条数写在末尾
+    snippet_length = max(20, min(100, DIGEST_TEXT_LIMIT // len(msgs) - 120))
+    lines = [header, ""]
+    length = len(header) + 1
+    for i, msg in enumerate(msgs, 1):
+        if DIGEST_BY == 'chat':
+            source = f"`{msg['matched_keyword']}` {MATCH_TYPE_MAP.get(msg['match_type'], '')}"
+        else:
+            source = f"👥 {_shorten(msg['chat_title'] or str(msg['chat_id']), 30)}"
+        line = f"{i}. {source} · 👤 {_shorten(msg['sender_name'] or '未知', 20)}"
+        if msg.get('occurrences', 1) > 1:
+            line += f" · 🔁{msg['occurrences']}"
+        line += f"\n    {_shorten(msg['message_text'], snippet_length)}"
+        link = message_link(msg)
+        if link:
+            line += f" [🔗]({link})"
+
+        rest = len(msgs) - i
+        footer = len(DIGEST_MORE_TEXT.format(count=rest)) + 1 if rest else 0
+        if length + 1 + len(line) + footer > DIGEST_TEXT_LIMIT:
+            lines.append(DIGEST_MORE_TEXT.format(count=len(msgs) - i + 1))
+            break
+        lines.append(line)
+        length += 1 + len(line)
+
+    return "\n".join(lines)
+
+def get_digest_keyboard(msgs: List[Dict]) -> Optional[InlineKeyboardMarkup]:
+    """汇总消息的键盘：每个发送者一行 get_keyboard 的按钮，按钮上带发送者名称"""
+    if len(msgs) == 1:
+        return get_keyboard(msgs[0])
+
+    rows = []
+    senders = set()
+    for msg in msgs:
+        if msg['sender_id'] is None or msg['sender_id'] in senders:
+            continue
+        senders.add(msg['sender_id'])
+        name = _shorten(msg['sender_name'] or msg['sender_username'] or str(msg['sender_id']), 12)
+        rows.append([
+            InlineKeyboardButton(f"{button.text} {name}", url=button.url, callback_data=button.callback_data)
+            for button in get_keyboard(msg).inline_keyboard[0]
+        ])
+        if len(rows) >= DIGEST_KEYBOARD_ROWS:
+            break
+    return InlineKeyboardMarkup(rows) if rows else None
+
+def format_shed(limit: int, items: List[Tuple[str, int]]) -> str:
+    """积压时跳过的任务摘要，items 为 [(关键词, 条数)]"""
+    total = sum(count for _, count in items)
+    lines = [
+        "⚠️ **推送积压**",
+        f"待推送超过 {limit} 条，已跳过 {total} 条低优先级的匹配：",
+        "",
+    ]
+    for keyword, count in items[:SHED_SUMMARY_KEYWORDS]:
+        lines.append(f"`{_shorten(keyword, 30)}` × {count}")
+    if len(items) > SHED_SUMMARY_KEYWORDS:
+        lines.append(f"…等 {len(items)} 个关键词")
+    lines += ["", "可以使用 /search 查看这些消息"]
+    return "\n".join(lines)
+
+async def send_to_admin(client: Client, admin_id: int, text: str, keyboard: InlineKeyboardMarkup) -> Optional[str]:
+    """在限速下向一个管理员推送，成功返回 None，失败返回错误信息"""
     try:
-        # 获取未推送的消息
-        messages = get_messages(is_pushed=False)
-        if not messages:
-            return
-        
-        # 推送消息
-        for msg in messages:
-            try:
-                # 如果发送者在黑名单中，直接标记为已推送并跳过
-                if msg['sender_id'] and is_user_blocked(msg['sender_id']):
-                    mark_as_pushed(
-                        client_id=msg['client_id'],
-                        chat_id=msg['chat_id'],
-                        message_id=msg['message_id']
-                    )
-                    continue
-                
-                text = await format_message(msg)
-                keyboard = get_keyboard(msg)
-                
-                # 推送给所有管理员
-                for admin_id in ADMIN_IDS:
-                    try:
-                        await client.send_message(
-                            admin_id, 
-                            text, 
-                            disable_web_page_preview=True,
-                            reply_markup=keyboard
-                        )
-                    except Exception as e:
-                        logger.error(f"向管理员 {admin_id} 推送失败: {e}")
-                        continue
-                
-                # 标记为已推送
-                if mark_as_pushed(
-                    client_id=msg['client_id'],
-                    chat_id=msg['chat_id'],
-                    message_id=msg['message_id']
-                ):
-                    logger.info(f"消息推送成功: {msg['chat_title']} - {msg['matched_keyword']}")
-                
-                # 避免频率限制
-                await asyncio.sleep(1)
-                
-            except Exception as e:
-                logger.error(f"消息推送失败: {e}")
-                await asyncio.sleep(5)  # 出错后多等待一会
+        await rate_limiter.call(
+            admin_id,
+            client.send_message,
+            admin_id,
+            text,
+            disable_web_page_preview=True,
+            reply_markup=keyboard
+        )
+        return None
+    except Exception as e:
+        logger.error(f"向管理员 {admin_id} 推送失败: {e}")
+        return str(e) or type(e).__name__
+
+def notify_push() -> None:
+    """唤醒推送协程，可在任意线程中调用"""
+    if _loop is None or _wakeup is None or _loop.is_closed():
+        return
+    _loop.call_soon_threadsafe(_wakeup.set)
+
+async def push_worker(client: Client):
+    """推送协程：有新消息写入或重试到期时被唤醒，空闲时不查询数据库"""
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    # 启动时先处理上次遗留的消息
+    _wakeup.set()
+
+    while True:
+        # 等待新消息，或等到最近一个重试任务到期
+        due = next_delivery_due()
+        timeout = None if due is None else max(0.0, due - time.time())
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        # 一次最多领取 PUSH_BATCH_SIZE 个任务，取满说明可能还有剩余
+        while await push_task(client) >= PUSH_BATCH_SIZE:
+            pass
+
+def _flush_results(sent: List[Tuple[int, int]], failed: List[Tuple[int, int, int, str]]) -> None:
+    """批量写入推送结果并清空列表"""
+    if not sent and not failed:
+        return
+    finish_deliveries(sent, failed, PUSH_MAX_ATTEMPTS, PUSH_RETRY_BASE, PUSH_RETRY_MAX)
+    sent.clear()
+    failed.clear()
+
+def _record_results(items: List[Dict], error: Optional[str],
+                    sent: List[Tuple[int, int]], failed: List[Tuple[int, int, int, str]]) -> None:
+    """记录一次发送涉及的所有推送任务的结果"""
+    for item in items:
+        if error is None:
+            sent.append((item['id'], item['admin_id']))
+            metrics.pushes.inc(('sent',))
+            message_date = item['message_date']
+            metrics.push_lag_seconds.observe((datetime.now(message_date.tzinfo) - message_date).total_seconds())
+        else:
+            failed.append((item['id'], item['admin_id'], item['attempts'], error))
+            metrics.pushes.inc(('failed',))
+
+async def _push_each(client: Client, deliveries: List[Dict],
+                     sent: List[Tuple[int, int]], failed: List[Tuple[int, int, int, str]]) -> None:
+    """逐条推送：同一条消息的任务一起推送给各个管理员"""
+    for rowid, group in groupby(deliveries, key=itemgetter('id')):
+        group = list(group)
+        msg = group[0]
+        try:
+            text = await format_message(msg)
+            keyboard = get_keyboard(msg)
+            
+            # 同时推送给各个管理员
+            results = await asyncio.gather(*(
+                send_to_admin(client, item['admin_id'], text, keyboard)
+                for item in group
+            ))
+        except Exception as e:
+            logger.error(f"消息推送失败: {e}")
+            results = [str(e) or type(e).__name__] * len(group)
+
+        for item, error in zip(group, results):
+            _record_results([item], error, sent, failed)
+        metrics.push_messages.inc(('single',), amount=len(group))
+
+        if not any(results):
+            logger.info(f"消息推送成功: {msg['chat_title']} - {msg['matched_keyword']}")
+
+        if len(sent) + len(failed) >= PUSH_ACK_BATCH:
+            _flush_results(sent, failed)
+
+async def _push_digest(client: Client, deliveries: List[Dict],
+                       sent: List[Tuple[int, int]], failed: List[Tuple[int, int, int, str]]) -> None:
+    """汇总推送：同一管理员同一分组的任务合并为一条消息"""
+    field = 'chat_id' if DIGEST_BY == 'chat' else 'matched_keyword'
+    groups: Dict[Tuple, List[Dict]] = {}
+    for item in deliveries:
+        groups.setdefault((item['admin_id'], item[field]), []).append(item)
+
+    async def send(admin_id: int, items: List[Dict]) -> None:
+        try:
+            text = await format_digest(items)
+            error = await send_to_admin(client, admin_id, text, get_digest_keyboard(items))
+        except Exception as e:
+            logger.error(f"汇总推送失败: {e}")
+            error = str(e) or type(e).__name__
+        _record_results(items, error, sent, failed)
+        metrics.push_messages.inc(('digest' if len(items) > 1 else 'single',))
+        if error is None:
+            logger.info(f"汇总推送成功: 管理员 {admin_id}，{len(items)} 条 - {items[0][field]}")
+
+    await asyncio.gather(*(send(admin_id, items) for (admin_id, _), items in groups.items()))
+
+async def shed_backlog(client: Client) -> int:
+    """推送积压超过上限时跳过低优先级的任务，按 PUSH_SHED 给管理员发送摘要，返回跳过的任务数"""
+    dropped: Dict[int, List[Tuple[str, int]]] = {}
+    for admin_id, keyword, count in shed_deliveries(BACKLOG_LIMIT):
+        dropped.setdefault(admin_id, []).append((keyword, count))
+
+    total = 0
+    for admin_id, items in dropped.items():
+        count = sum(n for _, n in items)
+        total += count
+        metrics.push_shed.inc(amount=count)
+        logger.warning(f"推送积压超过 {BACKLOG_LIMIT} 条，已跳过管理员 {admin_id} 的 {count} 个低优先级任务")
+        if PUSH_SHED == 'summary':
+            await send_to_admin(client, admin_id, format_shed(BACKLOG_LIMIT, items), None)
+    return total
+
+async def push_task(client: Client) -> int:
+    """推送任务，返回本次领取的任务数"""
+    sent: List[Tuple[int, int]] = []
+    failed: List[Tuple[int, int, int, str]] = []
+    try:
+        # 积压时先跳过低优先级的任务，让高优先级的匹配尽快送达
+        if BACKLOG_LIMIT > 0:
+            await shed_backlog(client)
+
+        # 领取到期的推送任务
+        deliveries = claim_deliveries(
+            ADMIN_IDS, PUSH_BATCH_SIZE, PUSH_LEASE_SECONDS,
+            DIGEST_BY, PUSH_DIGEST_WINDOW, PUSH_DIGEST_MAX
+        )
+        if not deliveries:
+            return 0
+
+        if DIGEST_BY:
+            await _push_digest(client, deliveries, sent, failed)
+        else:
+            await _push_each(client, deliveries, sent, failed)
+        return len(deliveries)
                 
     except Exception as e:
-        logger.error(f"推送任务异常: {e}")
\ No newline at end of file
+        logger.error(f"推送任务异常: {e}")
+        return 0
+    finally:
+        try:
+            _flush_results(sent, failed)
+        except Exception as e:
+            logger.error(f"写入推送结果失败: {e}")
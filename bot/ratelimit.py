@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from pyrogram import errors
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 capacity 个"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # 等待者按先来后到取令牌
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds: float) -> None:
+        """暂停发放令牌（收到 FloodWait 时使用），恢复后从空桶开始补充"""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
+
+    async def acquire(self) -> None:
+        """取一个令牌，有令牌时立即返回，否则只等待到下一个令牌可用"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class RateLimiter:
+    """按 Telegram 机器人限制发送：全局一个令牌桶，每个会话各一个令牌桶"""
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, flood_retries: int = 3):
+        self.flood_retries = flood_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    async def call(self, chat_id: int, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """在限速下调用 func，遇到 FloodWait 时按要求的秒数暂停该会话后重试"""
+        bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                return await func(*args, **kwargs)
+            except errors.FloodWait as e:
+                attempt += 1
+                if attempt > self.flood_retries:
+                    raise
+                logger.warning(f"触发频率限制，会话 {chat_id} 暂停 {e.value} 秒")
+                bucket.pause(e.value)
@@ -1,12 +1,26 @@
 import os
+import asyncio
+import itertools
+from typing import List, Optional, Tuple
 
 from pyrogram import Client, filters, types, helpers, errors, enums
 import logging
 from config import (
     API_ID, API_HASH, BOT_TOKEN,ADMIN_IDS,
-    SESSIONS_FILE, KEYWORDS_FILE, load_json, save_json
+    SESSIONS_FILE, KEYWORDS_FILE, RAW_ARCHIVE_DAYS, SHARDS, load_json, save_json
 )
-from db import block_user
+from db import (
+    block_user, get_dead_letters, count_dead_letters, retry_dead_letters, clear_dead_letters,
+    search_messages
+)
+from ingest import TTLCache
+from bot.push import notify_push
+from supervisor import supervisor
+from shard import SHARD_METRICS_INTERVAL
+from keywords import keyword_store
+from priority import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, PRIORITY_NAMES
+import metrics
+import rawarchive
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +42,11 @@ async def start_markup():
                 ("添加关键词", "keyword_add"),
                 ("删除关键词", "keyword_del"),
                 ("查看关键词", "keyword_list"),
+            ],
+            [
+                ("关键词优先级", "keyword_prio"),
+                ("会话规则", "chat_menu"),
+                ("推送失败记录", "push_failed"),
             ]
         ]
     )
@@ -41,6 +60,139 @@ async def start(client:Client,message:types.Message):
     markup = await start_markup()
     await message.reply_text(text,reply_markup=markup,quote=False)
 
+def format_seconds(value) -> str:
+    if value is None:
+        return "-"
+    return f"{value * 1000:.2f}ms" if value < 1 else f"{value:.1f}s"
+
+def stats_text() -> str:
+    """运行状态摘要"""
+    text = "**运行状态**\n\n"
+    if SHARDS > 1:
+        # 采集在工作进程中进行，这里是各分片定期上报的合计
+        text += f"🧩 {SHARDS} 个分片合计，每 {SHARD_METRICS_INTERVAL} 秒上报一次\n"
+
+    seen = metrics.messages_seen.items()
+    text += f"📥 收到消息：{int(sum(v for _, v in seen))} 条\n"
+    for (name,), value in seen:
+        text += f"   {name}：{int(value)}\n"
+    text += f"🎯 匹配成功：{int(metrics.messages_matched.value())} 条\n"
+    text += (
+        f"⏱ 匹配耗时：p50 {format_seconds(metrics.match_seconds.quantile(0.5))}，"
+        f"p99 {format_seconds(metrics.match_seconds.quantile(0.99))}\n\n"
+    )
+
+    text += f"💾 写入队列：{int(metrics.write_queue_depth.value())} 条\n"
+    text += (
+        f"⏱ 写入耗时：p50 {format_seconds(metrics.db_write_seconds.quantile(0.5))}，"
+        f"p99 {format_seconds(metrics.db_write_seconds.quantile(0.99))}\n\n"
+    )
+
+    text += f"📤 待推送：{int(metrics.pending_pushes.value())} 条\n"
+    text += (
+        f"✅ 推送成功 {int(metrics.pushes.value(('sent',)))} 次，"
+        f"❌ 失败 {int(metrics.pushes.value(('failed',)))} 次\n"
+    )
+    text += (
+        f"📨 发出消息 {int(metrics.push_messages.value())} 条，"
+        f"其中汇总 {int(metrics.push_messages.value(('digest',)))} 条\n"
+    )
+    if metrics.push_shed.value():
+        text += f"⚠️ 积压跳过：{int(metrics.push_shed.value())} 条低优先级任务\n"
+    text += (
+        f"⏱ 推送延迟：p50 {format_seconds(metrics.push_lag_seconds.quantile(0.5))}，"
+        f"p99 {format_seconds(metrics.push_lag_seconds.quantile(0.99))}"
+    )
+    return text
+
+@Client.on_message(filters.command("stats")&filters.private)
+async def stats(client:Client,message:types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    await message.reply_text(stats_text(),quote=False)
+
+SEARCH_PAGE_SIZE = 10
+# 搜索会话：编号 -> [搜索内容, 各页的游标]，翻页按钮只带编号和页码
+search_sessions = TTLCache(1000, 3600)
+_search_ids = itertools.count(1)
+
+async def search_page(token: int, page: int) -> Optional[Tuple[str, types.InlineKeyboardMarkup]]:
+    """生成一页搜索结果，会话已过期时返回 None"""
+    session = search_sessions.get(token)
+    if session is None or page >= len(session[1]):
+        return None
+    query, cursors = session
+
+    # 多取一条判断是否还有下一页
+    results = await asyncio.get_running_loop().run_in_executor(
+        None, search_messages, query, cursors[page], SEARCH_PAGE_SIZE + 1
+    )
+    has_next = len(results) > SEARCH_PAGE_SIZE
+    results = results[:SEARCH_PAGE_SIZE]
+    if has_next and len(cursors) == page + 1:
+        cursors.append(results[-1]['id'])
+
+    if not results:
+        return f"🔎 没有找到包含「{query}」的消息", None
+
+    text = f"🔎 **搜索**：{query}（第 {page + 1} 页）\n\n"
+    for i, item in enumerate(results, page * SEARCH_PAGE_SIZE + 1):
+        text += f"{i}. `{item['message_date']:%Y-%m-%d %H:%M}` {item['chat_title']} - {item['sender_name'] or '未知'}\n"
+        text += f"   {item['snippet'] or ''}\n"
+        if item['chat_username']:
+            text += f"   🔗 https://t.me/{item['chat_username']}/{item['message_id']}\n"
+        text += "\n"
+
+    buttons = []
+    if page > 0:
+        buttons.append(("◀️ 上一页", f"search_{token}_{page - 1}"))
+    if has_next:
+        buttons.append(("下一页 ▶️", f"search_{token}_{page + 1}"))
+    return text, helpers.ikb([buttons]) if buttons else None
+
+@Client.on_message(filters.command("search")&filters.private)
+async def search(client:Client,message:types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2 or not parts[1].strip():
+        await message.reply_text("用法：/search 搜索内容\n多个词用空格分开，需同时包含", quote=False)
+        return
+
+    token = next(_search_ids)
+    search_sessions.put(token, [parts[1].strip(), [None]])
+    text, markup = await search_page(token, 0)
+    await message.reply_text(text, reply_markup=markup, disable_web_page_preview=True, quote=False)
+
+
+# 进行中的回溯任务，保留引用避免被回收
+backfill_tasks = set()
+
+def start_backfill(client: Client, admin_id: int, keyword: str, match_type: str, chat_id: Optional[int] = None) -> str:
+    """新增关键词后在后台回溯原始消息归档，返回附加到提示中的说明"""
+    if RAW_ARCHIVE_DAYS <= 0:
+        return ""
+
+    async def run():
+        try:
+            scanned, matched, inserted = await asyncio.get_running_loop().run_in_executor(
+                None, rawarchive.backfill, keyword, match_type, RAW_ARCHIVE_DAYS, chat_id
+            )
+            await client.send_message(
+                admin_id,
+                f"🔁 关键词「{keyword}」回溯完成：扫描 {scanned} 条，命中 {matched} 条，"
+                f"新增 {inserted} 条（可用 /search 查看）"
+            )
+        except Exception as e:
+            logger.error(f"关键词回溯失败: {keyword}, 错误: {e}")
+
+    task = asyncio.create_task(run())
+    backfill_tasks.add(task)
+    task.add_done_callback(backfill_tasks.discard)
+    return f"\n正在回溯最近 {RAW_ARCHIVE_DAYS} 天的消息…"
+
 
 @Client.on_callback_query(filters.regex("user"))
 async def handle_user(client: Client, callback: types.CallbackQuery):
@@ -233,6 +385,8 @@ async def handle_user(client: Client, callback: types.CallbackQuery):
             finally:
                 if account and account.is_connected:
                     await account.disconnect()
+                # 会话文件已释放，通知立即启动新监听号
+                supervisor.notify()
 
                 
         elif command[1] == "del":
@@ -307,9 +461,10 @@ async def handle_user(client: Client, callback: types.CallbackQuery):
                 os.remove(session_file)
                 logger.info(f"已删除会话文件：{session_file}")
 
-            # 更新 sessions.json
+            # 更新 sessions.json，并通知立即停止该监听号
             sessions = [s for s in sessions if s["phone"] != phone]
             save_json(SESSIONS_FILE, sessions)
+            supervisor.notify()
             
             await callback.edit_message_text(
                 text=f"✅ 监听号 {phone} 已删除",
@@ -351,6 +506,26 @@ async def handle_user(client: Client, callback: types.CallbackQuery):
     except Exception as e:
         logger.error(f"处理用户命令错误: {str(e)}")
 
+PRIORITY_ICONS = {PRIORITY_HIGH: "🔴", PRIORITY_NORMAL: "🟡", PRIORITY_LOW: "⚪️"}
+# 优先级菜单每页的关键词数，Telegram 限制一个键盘最多 100 个按钮
+PRIORITY_PAGE_SIZE = 20
+
+def priority_keywords() -> List[Tuple[str, str]]:
+    """可以设置优先级的关键词 [(关键词, 匹配模式)]，包括会话专属关键词，按钮按下标引用"""
+    snapshot = keyword_store.snapshot
+    items = [(keyword, "exact") for keyword in snapshot.exact]
+    items += [(keyword, "fuzzy") for keyword in snapshot.fuzzy]
+    for _, scoped in sorted(snapshot.chat_keywords.items()):
+        for match_type in ("exact", "fuzzy"):
+            items += [(keyword, match_type) for keyword in scoped[match_type]]
+    # 优先级按关键词设置，同一个关键词只列一次
+    seen = set()
+    return [item for item in items if not (item[0] in seen or seen.add(item[0]))]
+
+def priority_text(keyword: str, match_type: str) -> str:
+    level = keyword_store.snapshot.priority(keyword, match_type)
+    return f"{PRIORITY_ICONS[level]} {keyword}（{PRIORITY_NAMES[level]}）"
+
 @Client.on_callback_query(filters.regex("keyword"))
 async def handle_keyword(client: Client, callback: types.CallbackQuery):
     command = callback.data.split("_")
@@ -397,25 +572,19 @@ async def handle_keyword(client: Client, callback: types.CallbackQuery):
                 keyword = keyword_input.text.strip()
                 await keyword_input.delete()
 
-                # 加载现有关键词
-                keywords = load_json(KEYWORDS_FILE, default={"exact": [], "fuzzy": []})
-                
-                # 检查关键词是否已存在
-                if keyword in keywords["exact"] or keyword in keywords["fuzzy"]:
+                # 添加关键词，已存在则提示
+                if not keyword_store.add(keyword, match_type):
                     await callback.edit_message_text(
                         text="⚠️ 该关键词已存在",
                         reply_markup=markup_return
                     )
                     return
 
-                # 添加关键词
-                keywords[match_type].append(keyword)
-                save_json(KEYWORDS_FILE, keywords)
-
                 await callback.edit_message_text(
                     text=f"✅ 关键词添加成功！\n"
                          f"关键词：{keyword}\n"
-                         f"匹配模式：{'完全匹配' if match_type == 'exact' else '模糊匹配'}",
+                         f"匹配模式：{'完全匹配' if match_type == 'exact' else '模糊匹配'}"
+                         f"{start_backfill(client, callback.from_user.id, keyword, match_type)}",
                     reply_markup=markup_return
                 )
 
@@ -427,7 +596,7 @@ async def handle_keyword(client: Client, callback: types.CallbackQuery):
 
         elif command[1] == "del":
             # 加载关键词列表
-            keywords = load_json(KEYWORDS_FILE, default={"exact": [], "fuzzy": []})
+            keywords = keyword_store.to_dict()
             
             if not keywords["exact"] and not keywords["fuzzy"]:
                 await callback.answer(
@@ -475,10 +644,7 @@ async def handle_keyword(client: Client, callback: types.CallbackQuery):
             match_type = command[2]
             keyword = command[3]
             
-            keywords = load_json(KEYWORDS_FILE, default={"exact": [], "fuzzy": []})
-            if keyword in keywords[match_type]:
-                keywords[match_type].remove(keyword)
-                save_json(KEYWORDS_FILE, keywords)
+            keyword_store.remove(keyword, match_type)
             
             await callback.edit_message_text(
                 text=f"✅ 关键词已删除",
@@ -487,7 +653,7 @@ async def handle_keyword(client: Client, callback: types.CallbackQuery):
             return
 
         elif command[1] == "list":
-            keywords = load_json(KEYWORDS_FILE, default={"exact": [], "fuzzy": []})
+            keywords = keyword_store.to_dict()
             
             if not keywords["exact"] and not keywords["fuzzy"]:
                 await callback.answer(
@@ -502,13 +668,13 @@ async def handle_keyword(client: Client, callback: types.CallbackQuery):
             if keywords["exact"]:
                 text += "🎯 **完全匹配**\n"
                 for i, keyword in enumerate(keywords["exact"], 1):
-                    text += f"{i}. {keyword}\n"
+                    text += f"{i}. {priority_text(keyword, 'exact')}\n"
                 text += "\n"
             
             if keywords["fuzzy"]:
                 text += "🔍 **模糊匹配**\n"
                 for i, keyword in enumerate(keywords["fuzzy"], 1):
-                    text += f"{i}. {keyword}\n"
+                    text += f"{i}. {priority_text(keyword, 'fuzzy')}\n"
 
             await callback.edit_message_text(
                 text=text,
@@ -516,6 +682,74 @@ async def handle_keyword(client: Client, callback: types.CallbackQuery):
             )
             return
 
+        elif command[1] == "prio":
+            items = priority_keywords()
+            if not items:
+                await callback.answer(
+                    text="📝 暂无关键词",
+                    show_alert=True
+                )
+                return
+
+            pages = (len(items) + PRIORITY_PAGE_SIZE - 1) // PRIORITY_PAGE_SIZE
+            page = min(int(command[2]) if len(command) > 2 else 0, pages - 1)
+            start = page * PRIORITY_PAGE_SIZE
+
+            # 按钮里只放快照版本和下标，关键词可能超出回调数据的长度限制
+            version = keyword_store.snapshot.version
+            buttons = [
+                [(priority_text(*item), f"keyword_prioset_{version}_{i}")]
+                for i, item in enumerate(items[start:start + PRIORITY_PAGE_SIZE], start)
+            ]
+            navigation = []
+            if page > 0:
+                navigation.append(("⬅️ 上一页", f"keyword_prio_{page - 1}"))
+            if page < pages - 1:
+                navigation.append(("下一页 ➡️", f"keyword_prio_{page + 1}"))
+            if navigation:
+                buttons.append(navigation)
+            buttons.append([("🔙 返回", "keyword_start")])
+            await callback.edit_message_text(
+                text="**关键词优先级**\n\n"
+                     "优先级高的匹配先推送；推送积压时，低优先级的匹配会被汇总或跳过。\n"
+                     "未单独设置时，完全匹配为普通，模糊匹配为低。\n\n"
+                     f"选择要设置的关键词（第 {page + 1}/{pages} 页）：",
+                reply_markup=helpers.ikb(buttons)
+            )
+            return
+
+        elif command[1] in ("prioset", "priolevel"):
+            version, index = int(command[2]), int(command[3])
+            items = priority_keywords()
+            if version != keyword_store.snapshot.version or index >= len(items):
+                await callback.answer(text="⚠️ 关键词已变化，请重新选择", show_alert=True)
+                return
+            keyword, match_type = items[index]
+
+            if command[1] == "prioset":
+                level_buttons = [
+                    [(f"{PRIORITY_ICONS[level]} {PRIORITY_NAMES[level]}", f"keyword_priolevel_{version}_{index}_{level}")
+                     for level in (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)],
+                    [("🔙 返回", f"keyword_prio_{index // PRIORITY_PAGE_SIZE}")]
+                ]
+                await callback.edit_message_text(
+                    text=f"关键词：{keyword}\n"
+                         f"当前优先级：{PRIORITY_NAMES[keyword_store.snapshot.priority(keyword, match_type)]}\n\n"
+                         f"请选择新的优先级：",
+                    reply_markup=helpers.ikb(level_buttons)
+                )
+                return
+
+            level = int(command[4])
+            keyword_store.set_priority(keyword, level)
+            await callback.edit_message_text(
+                text=f"✅ 优先级已设置\n"
+                     f"关键词：{keyword}\n"
+                     f"优先级：{PRIORITY_NAMES[level]}",
+                reply_markup=helpers.ikb([[("🔙 返回", f"keyword_prio_{index // PRIORITY_PAGE_SIZE}")]])
+            )
+            return
+
         elif command[1] == "start":
             await client.stop_listening(chat_id=callback.from_user.id)
             await callback.edit_message_text(
@@ -526,6 +760,272 @@ async def handle_keyword(client: Client, callback: types.CallbackQuery):
     except Exception as e:
         logger.error(f"处理关键词命令错误: {str(e)}")
 
+CHAT_RULE_NAMES = {
+    "ignored_chats": "🚫 忽略",
+    "allowed_chats": "✅ 只监听",
+}
+
+def chat_rules() -> List[Tuple]:
+    """当前所有会话规则，删除按钮按下标引用"""
+    snapshot = keyword_store.snapshot
+    rules = [("ignored_chats", chat_id) for chat_id in sorted(snapshot.ignored_chats)]
+    rules += [("allowed_chats", chat_id) for chat_id in sorted(snapshot.allowed_chats)]
+    for chat_id, scoped in sorted(snapshot.chat_keywords.items()):
+        for match_type in ("exact", "fuzzy"):
+            for keyword in scoped[match_type]:
+                rules.append(("chats", chat_id, match_type, keyword))
+    return rules
+
+def chat_rule_text(rule: Tuple) -> str:
+    if rule[0] == "chats":
+        _, chat_id, match_type, keyword = rule
+        return f"{'🎯' if match_type == 'exact' else '🔍'} {chat_id}：{keyword}"
+    return f"{CHAT_RULE_NAMES[rule[0]]} {rule[1]}"
+
+async def listen_chat_id(client: Client, callback: types.CallbackQuery) -> int:
+    """等待管理员输入会话 ID，格式错误时抛出 ValueError"""
+    chat_input = await client.listen(
+        chat_id=callback.from_user.id,
+        filters=filters.text,
+        timeout=120
+    )
+    text = chat_input.text.strip()
+    await chat_input.delete()
+    return int(text)
+
+@Client.on_callback_query(filters.regex("^chat_"))
+async def handle_chat(client: Client, callback: types.CallbackQuery):
+    command = callback.data.split("_")
+    try:
+        markup_cancel = helpers.ikb([[("🚫 取消", "chat_menu")]])
+        markup_return = helpers.ikb([[("🔙 返回", "chat_menu")]])
+        chat_id_prompt = "请输入**会话 ID**\n格式示例：-1001234567890"
+
+        if command[1] == "menu":
+            await client.stop_listening(chat_id=callback.from_user.id)
+            snapshot = keyword_store.snapshot
+            buttons = [
+                [("🚫 忽略会话", "chat_add_ignored"), ("✅ 只监听会话", "chat_add_allowed")],
+                [("🏷 添加会话关键词", "chat_kw")],
+                [("📋 查看规则", "chat_list"), ("🗑 删除规则", "chat_del")],
+                [("🔙 返回", "chat_start")]
+            ]
+            await callback.edit_message_text(
+                text="**会话规则**\n\n"
+                     "🚫 忽略会话：该会话的消息直接丢弃，不做匹配\n"
+                     "✅ 只监听会话：设置后只匹配这些会话（以及有专属关键词的会话）\n"
+                     "🏷 会话关键词：只在指定会话中生效，与全局关键词一起匹配\n\n"
+                     f"当前忽略 {len(snapshot.ignored_chats)} 个，只监听 {len(snapshot.allowed_chats)} 个，"
+                     f"{len(snapshot.chat_keywords)} 个会话有专属关键词",
+                reply_markup=helpers.ikb(buttons)
+            )
+            return
+
+        elif command[1] == "add":
+            rule = f"{command[2]}_chats"
+            await callback.edit_message_text(text=chat_id_prompt, reply_markup=markup_cancel)
+            try:
+                chat_id = await listen_chat_id(client, callback)
+            except ValueError:
+                await callback.edit_message_text(text="⚠️ 会话 ID 必须是数字", reply_markup=markup_return)
+                return
+            except TimeoutError:
+                await callback.edit_message_text(text="⏰ 操作超时，请重新开始", reply_markup=markup_return)
+                return
+
+            if not keyword_store.add_chat(rule, chat_id):
+                await callback.edit_message_text(text="⚠️ 该规则已存在", reply_markup=markup_return)
+                return
+            await callback.edit_message_text(
+                text=f"✅ 规则添加成功！\n{chat_rule_text((rule, chat_id))}",
+                reply_markup=markup_return
+            )
+            return
+
+        elif command[1] == "kw":
+            match_buttons = [
+                [("🎯 完全匹配", "chat_kwtype_exact")],
+                [("🔍 模糊匹配", "chat_kwtype_fuzzy")],
+                [("🔙 返回", "chat_menu")]
+            ]
+            await callback.edit_message_text(
+                text="请选择会话关键词的匹配模式：",
+                reply_markup=helpers.ikb(match_buttons)
+            )
+            return
+
+        elif command[1] == "kwtype":
+            match_type = command[2]  # exact 或 fuzzy
+            await callback.edit_message_text(text=chat_id_prompt, reply_markup=markup_cancel)
+            try:
+                chat_id = await listen_chat_id(client, callback)
+                await callback.edit_message_text(
+                    text=f"请输入会话 `{chat_id}` 的专属关键词：",
+                    reply_markup=markup_cancel
+                )
+                keyword_input = await client.listen(
+                    chat_id=callback.from_user.id,
+                    filters=filters.text,
+                    timeout=120
+                )
+                keyword = keyword_input.text.strip()
+                await keyword_input.delete()
+            except ValueError:
+                await callback.edit_message_text(text="⚠️ 会话 ID 必须是数字", reply_markup=markup_return)
+                return
+            except TimeoutError:
+                await callback.edit_message_text(text="⏰ 操作超时，请重新开始", reply_markup=markup_return)
+                return
+
+            if not keyword_store.add(keyword, match_type, chat_id=chat_id):
+                await callback.edit_message_text(text="⚠️ 该会话已有这个关键词", reply_markup=markup_return)
+                return
+            await callback.edit_message_text(
+                text=f"✅ 会话关键词添加成功！\n{chat_rule_text(('chats', chat_id, match_type, keyword))}"
+                     f"{start_backfill(client, callback.from_user.id, keyword, match_type, chat_id)}",
+                reply_markup=markup_return
+            )
+            return
+
+        elif command[1] == "list":
+            rules = chat_rules()
+            if not rules:
+                await callback.answer(text="📝 暂无会话规则", show_alert=True)
+                return
+
+            text = "**当前会话规则**\n\n"
+            for i, rule in enumerate(rules, 1):
+                text += f"{i}. {chat_rule_text(rule)}\n"
+            await callback.edit_message_text(text=text, reply_markup=markup_return)
+            return
+
+        elif command[1] == "del":
+            rules = chat_rules()
+            if not rules:
+                await callback.answer(text="📝 暂无会话规则", show_alert=True)
+                return
+
+            # 按钮里只放快照版本和下标，关键词可能超出回调数据的长度限制
+            version = keyword_store.snapshot.version
+            buttons = [
+                [(chat_rule_text(rule), f"chat_delok_{version}_{i}")]
+                for i, rule in enumerate(rules)
+            ]
+            buttons.append([("🔙 返回", "chat_menu")])
+            await callback.edit_message_text(
+                text="选择要删除的会话规则：",
+                reply_markup=helpers.ikb(buttons)
+            )
+            return
+
+        elif command[1] in ("delok", "delconfirm"):
+            version, index = int(command[2]), int(command[3])
+            rules = chat_rules()
+            if version != keyword_store.snapshot.version or index >= len(rules):
+                await callback.answer(text="⚠️ 规则已变化，请重新选择", show_alert=True)
+                return
+            rule = rules[index]
+
+            if command[1] == "delok":
+                confirm_buttons = [
+                    [("⚠️ 确认删除", f"chat_delconfirm_{version}_{index}"),
+                     ("🔙 返回", "chat_del")]
+                ]
+                await callback.edit_message_text(
+                    text=f"确认删除以下会话规则？\n\n{chat_rule_text(rule)}",
+                    reply_markup=helpers.ikb(confirm_buttons)
+                )
+                return
+
+            if rule[0] == "chats":
+                _, chat_id, match_type, keyword = rule
+                keyword_store.remove(keyword, match_type, chat_id=chat_id)
+            else:
+                keyword_store.remove_chat(rule[0], rule[1])
+            await callback.edit_message_text(text="✅ 会话规则已删除", reply_markup=markup_return)
+            return
+
+        elif command[1] == "start":
+            await client.stop_listening(chat_id=callback.from_user.id)
+            await callback.edit_message_text(
+                text=await start_text(),
+                reply_markup=await start_markup()
+            )
+
+    except Exception as e:
+        logger.error(f"处理会话规则命令错误: {str(e)}")
+
+@Client.on_callback_query(filters.regex("^search_"))
+async def handle_search(client: Client, callback: types.CallbackQuery):
+    try:
+        _, token, page = callback.data.split("_")
+        result = await search_page(int(token), int(page))
+        if result is None:
+            await callback.answer(text="⏰ 搜索已过期，请重新搜索", show_alert=True)
+            return
+        text, markup = result
+        await callback.edit_message_text(text=text, reply_markup=markup, disable_web_page_preview=True)
+    except Exception as e:
+        logger.error(f"处理搜索翻页错误: {str(e)}")
+
+@Client.on_callback_query(filters.regex("^push_"))
+async def handle_push(client: Client, callback: types.CallbackQuery):
+    command = callback.data.split("_")
+    try:
+        markup_return = helpers.ikb([[("🔙 返回", "push_start")]])
+
+        if command[1] == "failed":
+            total = count_dead_letters()
+            if not total:
+                await callback.answer(
+                    text="📭 暂无推送失败记录",
+                    show_alert=True
+                )
+                return
+
+            # 生成死信列表，只显示最近的 10 条
+            text = f"**推送失败记录**（共 {total} 条）\n\n"
+            for i, item in enumerate(get_dead_letters(limit=10), 1):
+                text += f"{i}. `{item['matched_keyword']}` - {item['chat_title']}\n"
+                text += f"   👤 管理员 `{item['admin_id']}`，已尝试 {item['attempts']} 次\n"
+                text += f"   ⚠️ {(item['last_error'] or '')[:100]}\n\n"
+
+            buttons = [
+                [("🔁 全部重试", "push_retry"), ("🗑 清空", "push_clear")],
+                [("🔙 返回", "push_start")]
+            ]
+            await callback.edit_message_text(
+                text=text,
+                reply_markup=helpers.ikb(buttons)
+            )
+            return
+
+        elif command[1] == "retry":
+            count = retry_dead_letters()
+            notify_push()
+            await callback.edit_message_text(
+                text=f"✅ 已重新加入推送队列：{count} 条",
+                reply_markup=markup_return
+            )
+            return
+
+        elif command[1] == "clear":
+            count = clear_dead_letters()
+            await callback.edit_message_text(
+                text=f"✅ 已清空推送失败记录：{count} 条",
+                reply_markup=markup_return
+            )
+            return
+
+        elif command[1] == "start":
+            await callback.edit_message_text(
+                text=await start_text(),
+                reply_markup=await start_markup()
+            )
+
+    except Exception as e:
+        logger.error(f"处理推送记录命令错误: {str(e)}")
+
 @Client.on_callback_query()
 async def handle_callback(client: Client, callback_query: types.CallbackQuery):
     """处理回调查询"""
@@ -26,6 +26,100 @@ DATA_DIR.mkdir(exist_ok=True)
 KEYWORDS_FILE = DATA_DIR / 'keywords.json'
 SESSIONS_FILE = DATA_DIR / 'sessions.json'
 
+# 检查 keywords.json 是否被手动修改的间隔（秒）
+KEYWORDS_RELOAD_INTERVAL = int(os.getenv('KEYWORDS_RELOAD_INTERVAL', '10'))
+
+# 消息批量写入：每批最多条数、最长等待秒数、队列容量
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '500'))
+WRITE_FLUSH_INTERVAL = float(os.getenv('WRITE_FLUSH_INTERVAL', '0.05'))
+WRITE_QUEUE_SIZE = int(os.getenv('WRITE_QUEUE_SIZE', '10000'))
+
+# SQLite 连接设置
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL').upper()
+if DB_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    raise ValueError(f"DB_SYNCHRONOUS 取值无效: {DB_SYNCHRONOUS}")
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', '-65536'))  # 负数表示 KiB，默认 64MB
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '30'))
+DB_READERS = int(os.getenv('DB_READERS', '4'))  # 只读连接池大小
+# 会话和发送者信息的缓存条数，信息没有变化时不重复写库
+METADATA_CACHE_SIZE = int(os.getenv('METADATA_CACHE_SIZE', '10000'))
+
+# 推送限速：全局每秒条数，单个会话每秒条数及突发上限
+PUSH_GLOBAL_RATE = float(os.getenv('PUSH_GLOBAL_RATE', '30'))
+PUSH_CHAT_RATE = float(os.getenv('PUSH_CHAT_RATE', '1'))
+PUSH_CHAT_BURST = float(os.getenv('PUSH_CHAT_BURST', '3'))
+
+# 推送任务：领取后的租约秒数、最多尝试次数、重试退避的初始与最大秒数
+PUSH_LEASE_SECONDS = float(os.getenv('PUSH_LEASE_SECONDS', '600'))
+PUSH_MAX_ATTEMPTS = int(os.getenv('PUSH_MAX_ATTEMPTS', '5'))
+PUSH_RETRY_BASE = float(os.getenv('PUSH_RETRY_BASE', '10'))
+PUSH_RETRY_MAX = float(os.getenv('PUSH_RETRY_MAX', '3600'))
+
+# 汇总推送：把同一管理员一段时间内的匹配按关键词（keyword）或会话（chat）合并为一条消息，off 为逐条推送；
+# 第一条匹配等待 PUSH_DIGEST_WINDOW 秒后推送，或攒够 PUSH_DIGEST_MAX 条立即推送
+PUSH_DIGEST = os.getenv('PUSH_DIGEST', 'off').lower()
+if PUSH_DIGEST not in ('off', 'keyword', 'chat'):
+    raise ValueError(f"PUSH_DIGEST 取值无效: {PUSH_DIGEST}")
+PUSH_DIGEST_WINDOW = float(os.getenv('PUSH_DIGEST_WINDOW', '60'))
+PUSH_DIGEST_MAX = int(os.getenv('PUSH_DIGEST_MAX', '20'))
+
+# 推送积压上限：某个管理员待推送的任务超过 PUSH_BACKLOG_LIMIT 条时（0 为不限制），
+# 从最早的低优先级任务开始跳过，直到回到上限以内；
+# summary 给管理员发一条按关键词统计的摘要，drop 只记录日志
+PUSH_BACKLOG_LIMIT = int(os.getenv('PUSH_BACKLOG_LIMIT', '0'))
+PUSH_SHED = os.getenv('PUSH_SHED', 'summary').lower()
+if PUSH_SHED not in ('summary', 'drop'):
+    raise ValueError(f"PUSH_SHED 取值无效: {PUSH_SHED}")
+
+# 跨监听号去重：内存中记住的消息数量和保留秒数
+DEDUP_CACHE_SIZE = int(os.getenv('DEDUP_CACHE_SIZE', '100000'))
+DEDUP_TTL = float(os.getenv('DEDUP_TTL', '600'))
+
+# 近似重复合并：时间窗口秒数（0 为关闭）、SimHash 最大汉明距离、参与检测的最短文本长度
+NEAR_DUP_WINDOW = float(os.getenv('NEAR_DUP_WINDOW', '3600'))
+NEAR_DUP_DISTANCE = int(os.getenv('NEAR_DUP_DISTANCE', '3'))
+NEAR_DUP_MIN_LENGTH = int(os.getenv('NEAR_DUP_MIN_LENGTH', '10'))
+
+# 监听号启动：同时启动的数量上限，启动失败后重试退避的初始与最大秒数
+CLIENT_START_CONCURRENCY = int(os.getenv('CLIENT_START_CONCURRENCY', '8'))
+CLIENT_RETRY_BASE = float(os.getenv('CLIENT_RETRY_BASE', '30'))
+CLIENT_RETRY_MAX = float(os.getenv('CLIENT_RETRY_MAX', '1800'))
+
+# 监听号存活检查：检查间隔、空闲多久后 ping、ping 超时、多久没有更新视为停滞并重启（秒）
+CLIENT_LIVENESS_INTERVAL = float(os.getenv('CLIENT_LIVENESS_INTERVAL', '60'))
+CLIENT_PING_IDLE = float(os.getenv('CLIENT_PING_IDLE', '120'))
+CLIENT_PING_TIMEOUT = float(os.getenv('CLIENT_PING_TIMEOUT', '10'))
+CLIENT_STALL_TIMEOUT = float(os.getenv('CLIENT_STALL_TIMEOUT', '1800'))
+
+# 多进程分片：监听号分散到多个工作进程，1 表示全部在主进程中运行
+SHARDS = max(1, int(os.getenv('SHARDS', '1')))
+# 工作进程发往主进程的匹配结果队列长度
+SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', '10000'))
+
+# Prometheus 指标服务，端口为 0 时不启动（分片进程依次使用后面的端口）
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# 录制群消息用于离线回放压测：是否开启、保存目录、每个分段文件的时长（秒）
+RECORD_UPDATES = os.getenv('RECORD_UPDATES', 'false').lower() in ('1', 'true', 'yes')
+RECORD_DIR = Path(os.getenv('RECORD_DIR', str(DATA_DIR / 'recordings')))
+RECORD_SEGMENT_SECONDS = float(os.getenv('RECORD_SEGMENT_SECONDS', '3600'))
+
+# 原始消息归档：保留最近 RAW_ARCHIVE_DAYS 天的录制分段，新增关键词时回溯匹配（0 表示不开启）
+RAW_ARCHIVE_DAYS = int(os.getenv('RAW_ARCHIVE_DAYS', '0'))
+if RAW_ARCHIVE_DAYS > 0:
+    RECORD_UPDATES = True
+
+# 数据保留：已推送超过 RETENTION_DAYS 天的消息移到归档文件（0 表示不清理）
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', '0'))
+ARCHIVE_DIR = Path(os.getenv('ARCHIVE_DIR', str(DATA_DIR / 'archive')))
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', '3600'))
+# 每批归档删除的条数、批次之间让出写锁的秒数、每批之后回收的空闲页数
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '500'))
+RETENTION_PAUSE = float(os.getenv('RETENTION_PAUSE', '0.05'))
+VACUUM_PAGES = int(os.getenv('VACUUM_PAGES', '1000'))
+
 def load_json(file_path: Path, default=None):
     """加载JSON文件"""
     try:
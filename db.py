@@ -1,17 +1,91 @@
 import os
+import queue
+import time
+import asyncio
+import logging
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, List, Dict
+from itertools import groupby
+from operator import itemgetter
+from collections.abc import Mapping
+from typing import Optional, List, Dict, Set, Tuple, Iterator, Callable, Sequence
 
-def get_conn():
-    db_path = os.path.join("data", "messages.db")
-    return sqlite3.connect(db_path)
+from config import (
+    WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL, WRITE_QUEUE_SIZE,
+    DB_SYNCHRONOUS, DB_CACHE_SIZE, DB_MMAP_SIZE, DB_BUSY_TIMEOUT, DB_READERS,
+    METADATA_CACHE_SIZE
+)
+from priority import PRIORITY_LOW, PRIORITY_NORMAL
+import metrics
 
-def init_db():
-    """初始化数据库"""
-    conn = get_conn()
-    c = conn.cursor()
-    
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 写线程的停止信号
+_STOP = object()
+
+DB_PATH = os.path.join("data", "messages.db")
+
+def get_conn() -> sqlite3.Connection:
+    """打开一个新的数据库连接，并应用连接级别的 PRAGMA 设置"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = {DB_CACHE_SIZE}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+# 唯一的写连接，所有写操作通过锁串行执行
+_write_conn: Optional[sqlite3.Connection] = None
+_write_lock = threading.RLock()
+
+# 只读连接池
+_read_pool: queue.LifoQueue = queue.LifoQueue(maxsize=DB_READERS)
+
+@contextmanager
+def write_conn() -> Iterator[sqlite3.Connection]:
+    """获取写连接，退出时提交事务，出错时回滚"""
+    global _write_conn
+    with _write_lock:
+        if _write_conn is None:
+            _write_conn = get_conn()
+        with _write_conn:
+            yield _write_conn
+
+@contextmanager
+def read_conn() -> Iterator[sqlite3.Connection]:
+    """从连接池借出一个只读连接，用完归还"""
+    try:
+        conn = _read_pool.get_nowait()
+    except queue.Empty:
+        conn = get_conn()
+        conn.execute("PRAGMA query_only = ON")
+    try:
+        yield conn
+    finally:
+        try:
+            _read_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+def close_db() -> None:
+    """关闭所有长连接"""
+    global _write_conn
+    with _write_lock:
+        if _write_conn is not None:
+            _write_conn.close()
+            _write_conn = None
+    while True:
+        try:
+            _read_pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+def _migrate_base_schema(c: sqlite3.Cursor) -> None:
+    """初始表结构"""
     # 创建消息表
     c.execute('''
         CREATE TABLE IF NOT EXISTS messages (
@@ -42,61 +116,900 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    conn.commit()
-    conn.close()
 
-def save_message(
+def _migrate_deliveries(c: sqlite3.Cursor) -> None:
+    """按管理员记录推送状态"""
+    # state: pending 待推送 / claimed 已领取 / sent 已送达 / failed 重试耗尽（死信）
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS deliveries (
+            message_rowid INTEGER NOT NULL,
+            admin_id INTEGER NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            lease_until REAL,
+            last_error TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (message_rowid, admin_id)
+        )
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deliveries_state
+        ON deliveries (state, next_attempt_at)
+    ''')
+
+def _migrate_pending_indexes(c: sqlite3.Cursor) -> None:
+    """只覆盖待处理数据的部分索引"""
+    # 待拆分的新消息
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_unpushed
+        ON messages (id) WHERE is_pushed = 0
+    ''')
+
+    # 推送任务按状态分别建部分索引，已送达的历史任务不进索引
+    c.execute('DROP INDEX IF EXISTS idx_deliveries_state')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deliveries_pending
+        ON deliveries (message_rowid) WHERE state = 'pending'
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deliveries_retry
+        ON deliveries (next_attempt_at) WHERE state = 'pending'
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deliveries_claimed
+        ON deliveries (lease_until) WHERE state = 'claimed'
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deliveries_failed
+        ON deliveries (updated_at) WHERE state = 'failed'
+    ''')
+
+def _migrate_dedup(c: sqlite3.Cursor) -> None:
+    """多个监听号看到的同一条消息只保存一次"""
+    # 普通群组的消息 ID 按账号独立编号，去重范围带上账号；超级群组和频道为 0
+    c.execute('ALTER TABLE messages ADD COLUMN dedup_scope INTEGER NOT NULL DEFAULT 0')
+    c.execute("UPDATE messages SET dedup_scope = client_id WHERE chat_type = 'group'")
+
+    # 记录每条消息被哪些监听号看到
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS message_sightings (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            dedup_scope INTEGER NOT NULL,
+            client_id INTEGER NOT NULL,
+            seen_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, message_id, dedup_scope, client_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO message_sightings (chat_id, message_id, dedup_scope, client_id, seen_at)
+        SELECT chat_id, message_id, dedup_scope, client_id, created_at FROM messages
+    ''')
+
+    # 删除已有的重复消息，每组保留最早的一条
+    c.execute('''
+        CREATE TEMP TABLE duplicate_messages AS
+        SELECT id FROM messages
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM messages GROUP BY chat_id, message_id, dedup_scope
+        )
+    ''')
+    c.execute('DELETE FROM deliveries WHERE message_rowid IN (SELECT id FROM duplicate_messages)')
+    c.execute('DELETE FROM messages WHERE id IN (SELECT id FROM duplicate_messages)')
+    c.execute('DROP TABLE duplicate_messages')
+
+    c.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_dedup
+        ON messages (chat_id, message_id, dedup_scope)
+    ''')
+
+def _migrate_occurrences(c: sqlite3.Cursor) -> None:
+    """记录近似重复消息的出现次数"""
+    c.execute('ALTER TABLE messages ADD COLUMN occurrences INTEGER NOT NULL DEFAULT 1')
+
+def _migrate_message_date_index(c: sqlite3.Cursor) -> None:
+    """按消息时间查询和归档使用的索引"""
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_date
+        ON messages (message_date, id)
+    ''')
+
+def _migrate_fts(c: sqlite3.Cursor) -> None:
+    """消息全文索引"""
+    # trigram 分词按三个字符切分，中文不需要额外分词；需要 SQLite 3.34 以上
+    try:
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                message_text, sender_name, chat_title,
+                content='messages', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning(f"当前 SQLite 不支持 FTS5 trigram，搜索将使用 LIKE 扫描: {e}")
+        return
+
+    # 外部内容表，由触发器与 messages 保持同步
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, message_text, sender_name, chat_title)
+            VALUES (new.id, new.message_text, new.sender_name, new.chat_title);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message_text, sender_name, chat_title)
+            VALUES ('delete', old.id, old.message_text, old.sender_name, old.chat_title);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update
+        AFTER UPDATE OF message_text, sender_name, chat_title ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message_text, sender_name, chat_title)
+            VALUES ('delete', old.id, old.message_text, old.sender_name, old.chat_title);
+            INSERT INTO messages_fts (rowid, message_text, sender_name, chat_title)
+            VALUES (new.id, new.message_text, new.sender_name, new.chat_title);
+        END
+    ''')
+    c.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+def _create_search_index(c: sqlite3.Cursor) -> None:
+    """全文索引：只索引消息文本"""
+    # 会话名称和发送者名称不进索引，搜索时到 chats、senders 表中匹配；
+    # 这样改名只更新一行，不必重建该会话全部消息的索引
+    try:
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                message_text, content='messages', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning(f"当前 SQLite 不支持 FTS5 trigram，搜索将使用 LIKE 扫描: {e}")
+        return
+
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message_text)
+            VALUES ('delete', old.id, old.message_text);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message_text ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message_text)
+            VALUES ('delete', old.id, old.message_text);
+            INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+        END
+    ''')
+    c.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+def _migrate_metadata_tables(c: sqlite3.Cursor) -> None:
+    """会话和发送者信息移到 chats、senders 表，消息表只保存 ID"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            title TEXT,
+            type TEXT NOT NULL,
+            username TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS senders (
+            sender_id INTEGER PRIMARY KEY,
+            username TEXT,
+            name TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 每个会话和发送者取最近一条消息中的信息
+    c.execute('''
+        INSERT OR IGNORE INTO chats (chat_id, title, type, username)
+        SELECT chat_id, chat_title, chat_type, chat_username FROM messages
+        WHERE id IN (SELECT MAX(id) FROM messages GROUP BY chat_id)
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO senders (sender_id, username, name)
+        SELECT sender_id, sender_username, sender_name FROM messages
+        WHERE id IN (SELECT MAX(id) FROM messages WHERE sender_id IS NOT NULL GROUP BY sender_id)
+    ''')
+
+    # 重建消息表去掉冗余的文本列（兼容不支持 DROP COLUMN 的 SQLite），全文索引随后重建
+    for trigger in ('messages_fts_insert', 'messages_fts_delete', 'messages_fts_update'):
+        c.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    c.execute('DROP TABLE IF EXISTS messages_fts')
+    sequence = c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").fetchone()
+    c.execute('''
+        CREATE TABLE messages_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            sender_id INTEGER,
+            message_id INTEGER NOT NULL,
+            message_text TEXT,
+            matched_keyword TEXT NOT NULL,
+            match_type TEXT NOT NULL,
+            message_date DATETIME NOT NULL,
+            is_pushed BOOLEAN NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            dedup_scope INTEGER NOT NULL DEFAULT 0,
+            occurrences INTEGER NOT NULL DEFAULT 1,
+            UNIQUE(client_id, chat_id, message_id)
+        )
+    ''')
+    c.execute('''
+        INSERT INTO messages_new (
+            id, client_id, chat_id, sender_id, message_id, message_text, matched_keyword,
+            match_type, message_date, is_pushed, created_at, dedup_scope, occurrences
+        )
+        SELECT
+            id, client_id, chat_id, sender_id, message_id, message_text, matched_keyword,
+            match_type, message_date, is_pushed, created_at, dedup_scope, occurrences
+        FROM messages
+    ''')
+    c.execute('DROP TABLE messages')
+    c.execute('ALTER TABLE messages_new RENAME TO messages')
+    if sequence:
+        c.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'messages'", sequence)
+
+    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_unpushed ON messages (id) WHERE is_pushed = 0')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_dedup ON messages (chat_id, message_id, dedup_scope)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_date ON messages (message_date, id)')
+    # 搜索按发送者名称匹配时按发送者取消息
+    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender_id)')
+    _create_search_index(c)
+
+def _migrate_priority(c: sqlite3.Cursor) -> None:
+    """推送任务按关键词优先级领取"""
+    # 已有消息按匹配模式取默认优先级：完全匹配为普通，模糊匹配为低
+    c.execute(f'ALTER TABLE messages ADD COLUMN priority INTEGER NOT NULL DEFAULT {PRIORITY_NORMAL}')
+    c.execute("UPDATE messages SET priority = ? WHERE match_type = 'fuzzy'", (PRIORITY_LOW,))
+
+    # 推送任务拆分时复制消息的优先级；积压时跳过的任务状态为 dropped
+    c.execute(f'ALTER TABLE deliveries ADD COLUMN priority INTEGER NOT NULL DEFAULT {PRIORITY_NORMAL}')
+    c.execute('''
+        UPDATE deliveries SET priority = (SELECT priority FROM messages WHERE id = message_rowid)
+        WHERE state IN ('pending', 'claimed')
+    ''')
+    c.execute('DROP INDEX IF EXISTS idx_deliveries_pending')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deliveries_pending
+        ON deliveries (priority DESC, message_rowid) WHERE state = 'pending'
+    ''')
+
+# 表结构迁移，按顺序执行；已执行到第几个记录在 PRAGMA user_version 中
+MIGRATIONS: List[Callable[[sqlite3.Cursor], None]] = [
+    _migrate_base_schema,
+    _migrate_deliveries,
+    _migrate_pending_indexes,
+    _migrate_dedup,
+    _migrate_occurrences,
+    _migrate_message_date_index,
+    _migrate_fts,
+    _migrate_metadata_tables,
+    _migrate_priority,
+]
+
+def init_db():
+    """初始化数据库：切换到 WAL 模式并执行未完成的迁移"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
+    conn.isolation_level = None
+    try:
+        # 新建的数据库启用增量回收，删除数据后由 incremental_vacuum 释放空间；
+        # 已有的数据库需要执行一次完整 VACUUM 才会生效（python retention.py vacuum --full）
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL 模式会持久保存在数据库文件中，读写互不阻塞
+        conn.execute("PRAGMA journal_mode = WAL")
+
+        c = conn.cursor()
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        for target, migrate in enumerate(MIGRATIONS, 1):
+            if target <= version:
+                continue
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                migrate(c)
+                c.execute(f"PRAGMA user_version = {target}")
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+            logger.info(f"数据库迁移完成: {migrate.__doc__} (版本 {target})")
+
+        # 全文索引不计入迁移版本：建库时 SQLite 不支持 trigram 的，升级 SQLite 后在启动时补建
+        missing = c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ).fetchone() is None
+        if missing:
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                _create_search_index(c)
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+
+INSERT_MESSAGE_SQL = '''
+    INSERT OR IGNORE INTO messages (
+        client_id, chat_id, sender_id, message_id,
+        message_text, matched_keyword, match_type,
+        message_date, is_pushed, dedup_scope, priority
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+UPSERT_CHAT_SQL = '''
+    INSERT INTO chats (chat_id, title, type, username) VALUES (?, ?, ?, ?)
+    ON CONFLICT (chat_id) DO UPDATE SET
+        title = excluded.title, type = excluded.type, username = excluded.username,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE (title, type, username) IS NOT (excluded.title, excluded.type, excluded.username)
+'''
+
+UPSERT_SENDER_SQL = '''
+    INSERT INTO senders (sender_id, username, name) VALUES (?, ?, ?)
+    ON CONFLICT (sender_id) DO UPDATE SET
+        username = excluded.username, name = excluded.name,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE (username, name) IS NOT (excluded.username, excluded.name)
+'''
+
+# 只补充缺少的会话和发送者信息，不覆盖已有的
+INSERT_CHAT_SQL = 'INSERT OR IGNORE INTO chats (chat_id, title, type, username) VALUES (?, ?, ?, ?)'
+INSERT_SENDER_SQL = 'INSERT OR IGNORE INTO senders (sender_id, username, name) VALUES (?, ?, ?)'
+
+INSERT_SIGHTING_SQL = '''
+    INSERT OR IGNORE INTO message_sightings (
+        chat_id, message_id, dedup_scope, client_id
+    ) VALUES (?, ?, ?, ?)
+'''
+
+def dedup_scope(chat_type: str, client_id: int) -> int:
+    """消息去重范围
+
+    超级群组和频道的消息 ID 对所有账号一致，按 (chat_id, message_id) 去重；
+    普通群组的消息 ID 按账号独立编号，需要带上账号。
+    """
+    return client_id if chat_type == 'group' else 0
+
+class MetadataCache:
+    """会话或发送者信息的 LRU 缓存：ID -> 最近一次写入的信息
+
+    写线程和同步写入都会用到，加锁保护。
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[int, Tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def changed(self, key: int, value: Tuple) -> bool:
+        """记录最新的信息，返回与上次写入相比是否有变化（不在缓存中也算变化）"""
+        with self._lock:
+            items = self._items
+            if items.get(key) == value:
+                items.move_to_end(key)
+                return False
+            items[key] = value
+            items.move_to_end(key)
+            if len(items) > self.max_size:
+                items.popitem(last=False)
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+chat_cache = MetadataCache(METADATA_CACHE_SIZE)
+sender_cache = MetadataCache(METADATA_CACHE_SIZE)
+
+def forget_metadata() -> None:
+    """写入失败时清空缓存，之后重新写入会话和发送者信息"""
+    chat_cache.clear()
+    sender_cache.clear()
+
+def message_statements(
     client_id: int, chat_id: int, chat_title: str,
     chat_type: str, chat_username: Optional[str],
     sender_id: Optional[int], sender_username: Optional[str],
     sender_name: Optional[str], message_id: int,
     message_text: str, matched_keyword: str,
     match_type: str, message_date: datetime,
-    is_pushed: bool = False
-) -> bool:
-    """保存匹配的消息到数据库，返回是否保存成功"""
-    conn = get_conn()
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute('''
-        INSERT INTO messages (
-            client_id, chat_id, chat_title, chat_type,
-            chat_username, sender_id, sender_username, sender_name,
-            message_id, message_text, matched_keyword, match_type,
-            message_date, is_pushed
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            client_id, chat_id, chat_title, chat_type,
-            chat_username, sender_id, sender_username, sender_name,
-            message_id, message_text, matched_keyword, match_type,
-            message_date.isoformat(), is_pushed
-        ))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        # 消息已存在
-        return False
-    finally:
-        conn.close()
+    is_pushed: bool = False, priority: int = PRIORITY_NORMAL,
+    keep_metadata: bool = False
+) -> List[Tuple[str, Tuple]]:
+    """保存一条匹配的消息需要执行的语句
 
-def mark_as_pushed(client_id: int, chat_id: int, message_id: int) -> bool:
-    """标记消息为已推送"""
-    conn = get_conn()
-    cursor = conn.cursor()
-    
+    会话和发送者信息与上次写入的相同时跳过，否则先写入 chats、senders，再写入消息。
+    keep_metadata 用于回溯历史消息：其中的名称可能已经过时，只补充缺少的信息，
+    不覆盖现有的会话和发送者信息，也不更新缓存。
+    """
+    statements = []
+    chat = (chat_id, chat_title, chat_type, chat_username)
+    sender = (sender_id, sender_username, sender_name)
+    if keep_metadata:
+        statements.append((INSERT_CHAT_SQL, chat))
+        if sender_id is not None:
+            statements.append((INSERT_SENDER_SQL, sender))
+    else:
+        if chat_cache.changed(chat_id, chat[1:]):
+            statements.append((UPSERT_CHAT_SQL, chat))
+        if sender_id is not None and sender_cache.changed(sender_id, sender[1:]):
+            statements.append((UPSERT_SENDER_SQL, sender))
+    statements.append((INSERT_MESSAGE_SQL, (
+        client_id, chat_id, sender_id, message_id,
+        message_text, matched_keyword, match_type,
+        message_date.isoformat(), is_pushed, dedup_scope(chat_type, client_id), priority
+    )))
+    return statements
+
+def execute_statements(conn: sqlite3.Connection, statements: List[Tuple[str, Tuple]]) -> int:
+    """按顺序执行语句，相邻的相同语句合并为 executemany，返回写入的消息条数"""
+    inserted = 0
+    for sql, items in groupby(statements, key=itemgetter(0)):
+        cursor = conn.executemany(sql, [params for _, params in items])
+        if sql == INSERT_MESSAGE_SQL:
+            inserted += cursor.rowcount
+    return inserted
+
+def save_message(**fields) -> bool:
+    """同步保存匹配的消息到数据库，返回是否保存成功（已存在时返回 False）"""
+    started = time.perf_counter()
     try:
-        cursor.execute('''
-        UPDATE messages SET is_pushed = 1
-        WHERE client_id = ? AND chat_id = ? AND message_id = ?
-        ''', (client_id, chat_id, message_id))
-        conn.commit()
-        return cursor.rowcount > 0
-    finally:
-        conn.close()
+        with write_conn() as conn:
+            inserted = execute_statements(conn, message_statements(**fields))
+    except sqlite3.Error:
+        forget_metadata()
+        raise
+    metrics.db_write_seconds.observe(time.perf_counter() - started)
+    metrics.db_rows_written.inc()
+    return inserted > 0
 
-def get_messages(
+async def enqueue_message(**fields) -> None:
+    """将匹配的消息放入写入队列，由写线程批量落库"""
+    for sql, params in message_statements(**fields):
+        await message_writer.submit(sql, params)
+
+COUNT_OCCURRENCE_SQL = '''
+    UPDATE messages SET occurrences = occurrences + 1
+    WHERE chat_id = ? AND message_id = ? AND dedup_scope = ?
+'''
+
+async def enqueue_occurrence(chat_id: int, message_id: int, scope: int) -> None:
+    """近似重复消息不单独保存，只给首次出现的那条计数加一"""
+    await message_writer.submit(COUNT_OCCURRENCE_SQL, (chat_id, message_id, scope))
+
+async def enqueue_sighting(chat_id: int, message_id: int, scope: int, client_id: int) -> None:
+    """记录某个监听号看到了这条消息"""
+    await message_writer.submit(INSERT_SIGHTING_SQL, (chat_id, message_id, scope, client_id))
+
+class MessageWriter:
+    """后台批量写入
+
+    写操作先进入有界队列，由单独的写线程取出，按批次在一个事务中
+    executemany 写入。批次达到 batch_size 或等待超过 flush_interval 秒即提交。
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # 每个批次提交后在写线程中调用，用于通知推送
+        self.on_flush: Optional[Callable[[], None]] = None
+
+    @property
+    def depth(self) -> int:
+        """队列中等待写入的数量"""
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        """启动写线程"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """写完队列中剩余的数据后停止写线程"""
+        with self._lock:
+            thread = self._thread
+            if not thread:
+                return
+            self._queue.put(_STOP)
+            thread.join(timeout)
+            self._thread = None
+
+    async def submit(self, sql: str, params: Tuple) -> None:
+        """提交一条写操作，队列已满时在线程池中等待，不阻塞事件循环"""
+        self.start()
+        item = (sql, params)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            logger.warning("写入队列已满，等待写线程处理")
+            await asyncio.get_running_loop().run_in_executor(None, self._queue.put, item)
+
+    def _next_batch(self) -> Tuple[List[Tuple[str, Tuple]], bool]:
+        """取出一个批次，返回 (批次, 是否收到停止信号)"""
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _write(self, batch: List[Tuple[str, Tuple]]) -> None:
+        """在一个事务中写入整个批次，相邻的相同语句合并为 executemany"""
+        started = time.perf_counter()
+        try:
+            with write_conn() as conn:
+                execute_statements(conn, batch)
+        except sqlite3.Error as e:
+            # 批量失败时逐条重试，避免一条坏数据拖累整批
+            logger.error(f"批量写入失败，逐条重试: {e}")
+            forget_metadata()
+            for sql, params in batch:
+                try:
+                    with write_conn() as conn:
+                        conn.execute(sql, params)
+                except sqlite3.Error as e:
+                    logger.error(f"写入失败: {e}")
+        metrics.db_write_seconds.observe(time.perf_counter() - started)
+        metrics.db_rows_written.inc(amount=len(batch))
+
+    def _run(self) -> None:
+        while True:
+            batch, stopping = self._next_batch()
+            if batch:
+                self._write(batch)
+                if self.on_flush:
+                    self.on_flush()
+            if stopping:
+                break
+
+# messages 表的列，查询时可以只选其中一部分
+MESSAGE_COLUMNS = (
+    'id', 'client_id', 'chat_id', 'chat_title', 'chat_type', 'chat_username',
+    'sender_id', 'sender_username', 'sender_name', 'message_id', 'message_text',
+    'matched_keyword', 'match_type', 'message_date', 'is_pushed', 'created_at',
+    'dedup_scope', 'occurrences', 'priority'
+)
+# 各列的取值：会话和发送者信息来自 chats、senders 表
+_COLUMN_SQL = {name: f"m.{name}" for name in MESSAGE_COLUMNS}
+_COLUMN_SQL.update(
+    chat_title='c.title', chat_type='c.type', chat_username='c.username',
+    sender_username='s.username', sender_name='s.name'
+)
+# 查询消息时关联会话和发送者信息，消息表别名为 m；没有用到的关联会被 SQLite 省略
+MESSAGE_JOINS = '''
+    LEFT JOIN chats c ON c.chat_id = m.chat_id
+    LEFT JOIN senders s ON s.sender_id = m.sender_id
+'''
+# 推送时用到的列
+PUSH_COLUMNS = (
+    'id', 'chat_id', 'chat_title', 'chat_username', 'sender_id', 'sender_username',
+    'sender_name', 'message_id', 'message_text', 'matched_keyword', 'match_type',
+    'message_date', 'occurrences', 'priority'
+)
+_DATE_COLUMNS = frozenset(('message_date', 'created_at'))
+
+class MessageRow(Mapping):
+    """一行查询结果
+
+    直接包装 sqlite 返回的元组，同一次查询的所有行共用一个列名索引，不为每行创建字典。
+    可以按列名（row['chat_id']）或属性（row.chat_id）取值，时间列在读取时才解析为 datetime，
+    is_pushed 读取时转换为布尔值。需要字典时使用 dict(row)。
+    """
+    __slots__ = ('_values', '_index')
+
+    def __init__(self, values: Tuple, index: Dict[str, int]):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, name: str):
+        value = self._values[self._index[name]]
+        if value is None:
+            return None
+        if name in _DATE_COLUMNS:
+            return datetime.fromisoformat(value)
+        if name == 'is_pushed':
+            return bool(value)
+        return value
+
+    def raw(self, name: str):
+        """未经转换的原始值"""
+        return self._values[self._index[name]]
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __repr__(self) -> str:
+        return f"MessageRow({dict(self)!r})"
+
+def _rows(cursor: sqlite3.Cursor, rows: List[Tuple]) -> List[MessageRow]:
+    """把一页查询结果包装为 MessageRow"""
+    index = {description[0]: i for i, description in enumerate(cursor.description)}
+    return [MessageRow(row, index) for row in rows]
+
+def message_select(columns: Optional[Sequence[str]] = None, required: Sequence[str] = ()) -> str:
+    """生成 SELECT 的列（配合 MESSAGE_JOINS 使用），columns 为 None 时选择全部列"""
+    if columns is None:
+        columns = MESSAGE_COLUMNS
+    unknown = set(columns) - set(MESSAGE_COLUMNS)
+    if unknown:
+        raise ValueError(f"未知的列: {', '.join(sorted(unknown))}")
+    # 游标分页需要的列放在前面，去掉重复
+    names = dict.fromkeys([*required, *columns])
+    return ', '.join(f"{_COLUMN_SQL[name]} AS {name}" for name in names)
+
+# 汇总推送的分组方式
+DIGEST_KEYS = {'keyword': 'm.matched_keyword', 'chat': 'm.chat_id'}
+
+def claim_deliveries(
+    admin_ids: List[int],
+    limit: int,
+    lease_seconds: float,
+    digest_by: Optional[str] = None,
+    digest_window: float = 0,
+    digest_max: int = 1
+) -> List[MessageRow]:
+    """领取到期的推送任务
+
+    新写入的消息先按管理员拆分为 pending 任务（messages.is_pushed 置 1），
+    再领取到期的 pending 任务和租约已过期的 claimed 任务，置为 claimed 并设置租约。
+    pending 任务按优先级从高到低、同一优先级按消息顺序领取，返回的结果也按这个顺序排列。
+    返回的每一项包含推送用到的消息字段（PUSH_COLUMNS）以及 admin_id、attempts。
+
+    digest_by 为 keyword 或 chat 时按汇总方式领取：新任务推迟 digest_window 秒到期，
+    同一管理员同一分组中有任务到期或攒够 digest_max 个时，整组（最多 digest_max 个）一起领取；
+    正在退避等待重试的任务不会被提前带上。
+    按组领取时不会拆开一组，返回的数量可能略超过 limit。
+    """
+    now = time.time()
+    delay = digest_window if digest_by else 0
+    with write_conn() as conn:
+        # 1. 新消息按管理员拆分，黑名单用户的消息直接跳过
+        conn.executemany('''
+            INSERT OR IGNORE INTO deliveries (message_rowid, admin_id, next_attempt_at, priority)
+            SELECT id, ?, ?, priority FROM messages
+            WHERE is_pushed = 0
+              AND (sender_id IS NULL OR sender_id NOT IN (SELECT user_id FROM blacklist))
+        ''', [(admin_id, now + delay if delay else 0) for admin_id in admin_ids])
+        conn.execute('UPDATE messages SET is_pushed = 1 WHERE is_pushed = 0')
+
+        # 2. 先领取租约已过期的任务（上次推送中断），再按优先级领取到期的 pending 任务
+        select = message_select(PUSH_COLUMNS)
+        cursor = conn.execute(f'''
+            SELECT d.admin_id, d.attempts, {select}
+            FROM deliveries d JOIN messages m ON m.id = d.message_rowid {MESSAGE_JOINS}
+            WHERE d.state = 'claimed' AND d.lease_until <= ?
+            LIMIT ?
+        ''', (now, limit))
+        rows = cursor.fetchall()
+        if digest_by and len(rows) < limit:
+            # 先汇总出到期的分组，按组的最高优先级、最早的消息排列，取够 limit 个任务为止（不拆开一组）；
+            # 再用一次查询取出这些组各自最早的 digest_max 个任务，每次领取只扫描两遍待推送任务
+            key = DIGEST_KEYS[digest_by]
+            groups = conn.execute(f'''
+                SELECT d.admin_id, {key}, MIN(COUNT(*), ?)
+                FROM deliveries d INDEXED BY idx_deliveries_pending
+                JOIN messages m ON m.id = d.message_rowid
+                WHERE d.state = 'pending' AND (d.attempts = 0 OR d.next_attempt_at <= ?)
+                GROUP BY d.admin_id, {key}
+                HAVING MIN(d.next_attempt_at) <= ? OR COUNT(*) >= ?
+                ORDER BY MAX(d.priority) DESC, MIN(d.message_rowid)
+            ''', (digest_max, now, now, digest_max))
+            selected = []
+            total = len(rows)
+            for admin_id, value, size in groups:
+                if total >= limit:
+                    break
+                selected += (admin_id, value)
+                total += size
+            groups.close()
+            if selected:
+                cursor = conn.execute(f'''
+                    WITH selected (admin_id, digest_key) AS (
+                        VALUES {', '.join(['(?, ?)'] * (len(selected) // 2))}
+                    )
+                    SELECT d.admin_id, d.attempts, {select}
+                    FROM (
+                        SELECT d.message_rowid, d.admin_id,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY d.admin_id, {key} ORDER BY d.priority DESC, d.message_rowid
+                               ) AS position
+                        FROM deliveries d INDEXED BY idx_deliveries_pending
+                        JOIN messages m ON m.id = d.message_rowid
+                        WHERE d.state = 'pending' AND (d.attempts = 0 OR d.next_attempt_at <= ?)
+                          AND (d.admin_id, {key}) IN (SELECT admin_id, digest_key FROM selected)
+                    ) g
+                    JOIN deliveries d ON d.message_rowid = g.message_rowid AND d.admin_id = g.admin_id
+                    JOIN messages m ON m.id = g.message_rowid {MESSAGE_JOINS}
+                    WHERE g.position <= ?
+                ''', (*selected, now, digest_max))
+                rows += cursor.fetchall()
+        elif not digest_by and len(rows) < limit:
+            cursor = conn.execute(f'''
+                SELECT d.admin_id, d.attempts, {select}
+                FROM deliveries d INDEXED BY idx_deliveries_pending
+                JOIN messages m ON m.id = d.message_rowid {MESSAGE_JOINS}
+                WHERE d.state = 'pending' AND d.next_attempt_at <= ?
+                ORDER BY d.priority DESC, d.message_rowid
+                LIMIT ?
+            ''', (now, limit - len(rows)))
+            rows += cursor.fetchall()
+        results = sorted(_rows(cursor, rows), key=lambda r: (-r['priority'], r['id']))
+
+        conn.executemany('''
+            UPDATE deliveries
+            SET state = 'claimed', lease_until = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE message_rowid = ? AND admin_id = ?
+        ''', [(now + lease_seconds, r['id'], r['admin_id']) for r in results])
+    return results
+
+def shed_deliveries(backlog_limit: int, priority: int = PRIORITY_LOW) -> List[Tuple[int, str, int]]:
+    """推送积压时跳过低优先级的任务
+
+    某个管理员的 pending 任务超过 backlog_limit 个时，从最早的、优先级不高于 priority 的任务开始
+    置为 dropped，直到回到上限以内；更高优先级的任务不会被跳过。消息本身保留，可以通过 /search 查看。
+    返回 [(管理员ID, 关键词, 跳过的任务数)]，同一管理员按数量从多到少排列。
+    """
+    if backlog_limit <= 0:
+        return []
+    dropped = []
+    with write_conn() as conn:
+        backlog = conn.execute('''
+            SELECT admin_id, COUNT(*) FROM deliveries INDEXED BY idx_deliveries_pending
+            WHERE state = 'pending'
+            GROUP BY admin_id
+            HAVING COUNT(*) > ?
+        ''', (backlog_limit,)).fetchall()
+        for admin_id, count in backlog:
+            rows = conn.execute('''
+                SELECT d.message_rowid, m.matched_keyword
+                FROM deliveries d INDEXED BY idx_deliveries_pending
+                JOIN messages m ON m.id = d.message_rowid
+                WHERE d.state = 'pending' AND d.admin_id = ? AND d.priority <= ?
+                ORDER BY d.message_rowid
+                LIMIT ?
+            ''', (admin_id, priority, count - backlog_limit)).fetchall()
+            conn.executemany('''
+                UPDATE deliveries SET state = 'dropped', updated_at = CURRENT_TIMESTAMP
+                WHERE message_rowid = ? AND admin_id = ?
+            ''', [(rowid, admin_id) for rowid, _ in rows])
+
+            counts: Dict[str, int] = {}
+            for _, keyword in rows:
+                counts[keyword] = counts.get(keyword, 0) + 1
+            dropped += [
+                (admin_id, keyword, n)
+                for keyword, n in sorted(counts.items(), key=itemgetter(1), reverse=True)
+            ]
+    return dropped
+
+def finish_deliveries(
+    sent: List[Tuple[int, int]],
+    failed: List[Tuple[int, int, int, str]],
+    max_attempts: int,
+    retry_base: float,
+    retry_max: float
+) -> None:
+    """在一个事务中写入推送结果
+
+    sent: [(消息行ID, 管理员ID)]
+    failed: [(消息行ID, 管理员ID, 之前的尝试次数, 错误信息)]，按指数退避重新排队，
+    尝试次数达到 max_attempts 后转入死信（failed）。
+    """
+    now = time.time()
+    retries = []
+    for rowid, admin_id, attempts, error in failed:
+        attempts += 1
+        if attempts >= max_attempts:
+            state, next_attempt_at = 'failed', now
+        else:
+            state = 'pending'
+            next_attempt_at = now + min(retry_max, retry_base * 2 ** (attempts - 1))
+        retries.append((state, attempts, next_attempt_at, error, rowid, admin_id))
+
+    with write_conn() as conn:
+        conn.executemany('''
+            UPDATE deliveries
+            SET state = 'sent', lease_until = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE message_rowid = ? AND admin_id = ?
+        ''', sent)
+        conn.executemany('''
+            UPDATE deliveries
+            SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ?,
+                lease_until = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE message_rowid = ? AND admin_id = ?
+        ''', retries)
+
+def next_delivery_due() -> Optional[float]:
+    """最近一个待推送任务的到期时间（Unix 时间戳），没有则返回 None"""
+    with read_conn() as conn:
+        row = conn.execute('''
+            SELECT MIN(due) FROM (
+                SELECT MIN(next_attempt_at) AS due FROM deliveries WHERE state = 'pending'
+                UNION ALL
+                SELECT MIN(lease_until) FROM deliveries WHERE state = 'claimed'
+            )
+        ''').fetchone()
+    return row[0]
+
+def get_dead_letters(limit: int = 20) -> List[MessageRow]:
+    """查询重试耗尽的推送任务，最新的在前"""
+    with read_conn() as conn:
+        cursor = conn.execute(f'''
+            SELECT d.admin_id, d.attempts, d.last_error, {message_select()}
+            FROM deliveries d JOIN messages m ON m.id = d.message_rowid {MESSAGE_JOINS}
+            WHERE d.state = 'failed'
+            ORDER BY d.updated_at DESC
+            LIMIT ?
+        ''', (limit,))
+        return _rows(cursor, cursor.fetchall())
+
+def count_pending_pushes() -> int:
+    """尚未送达的推送任务数，包括还没拆分给管理员的新消息
+
+    pending 和 claimed 分开计数，各自走部分索引，不扫描已送达的历史任务。
+    """
+    with read_conn() as conn:
+        return conn.execute('''
+            SELECT (SELECT COUNT(*) FROM messages WHERE is_pushed = 0)
+                 + (SELECT COUNT(*) FROM deliveries WHERE state = 'pending')
+                 + (SELECT COUNT(*) FROM deliveries WHERE state = 'claimed')
+        ''').fetchone()[0]
+
+def count_dead_letters() -> int:
+    """死信数量"""
+    with read_conn() as conn:
+        return conn.execute("SELECT COUNT(*) FROM deliveries WHERE state = 'failed'").fetchone()[0]
+
+def retry_dead_letters() -> int:
+    """把死信重新放回待推送队列，返回数量"""
+    with write_conn() as conn:
+        cursor = conn.execute('''
+            UPDATE deliveries
+            SET state = 'pending', attempts = 0, next_attempt_at = 0, updated_at = CURRENT_TIMESTAMP
+            WHERE state = 'failed'
+        ''')
+        return cursor.rowcount
+
+def clear_dead_letters() -> int:
+    """删除所有死信，返回数量"""
+    with write_conn() as conn:
+        return conn.execute("DELETE FROM deliveries WHERE state = 'failed'").rowcount
+
+def query_messages(
     keyword: Optional[str] = None,
     match_type: Optional[str] = None,
     chat_id: Optional[int] = None,
@@ -104,95 +1017,260 @@ def get_messages(
     is_pushed: Optional[bool] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    limit: int = 100
-) -> List[Dict]:
-    """查询匹配的消息"""
-    conn = get_conn()
-    cursor = conn.cursor()
-    
-    query = "SELECT * FROM messages WHERE 1=1"
+    limit: Optional[int] = None,
+    columns: Optional[Sequence[str]] = None,
+    page_size: int = 500
+) -> Iterator[MessageRow]:
+    """按消息时间从新到旧流式查询匹配的消息
+
+    以 (message_date, id) 为游标分页读取，每页单独查询，遍历大量结果时内存占用固定，
+    也不会长时间占用读事务。columns 指定只读取哪些列（MESSAGE_COLUMNS 中的列名），
+    limit 为 None 时返回全部结果。
+    """
+    query = f"SELECT {message_select(columns, ('id', 'message_date'))} FROM messages m {MESSAGE_JOINS} WHERE 1=1"
     params = []
     
     if keyword:
-        query += " AND matched_keyword = ?"
+        query += " AND m.matched_keyword = ?"
         params.append(keyword)
     
     if match_type:
-        query += " AND match_type = ?"
+        query += " AND m.match_type = ?"
         params.append(match_type)
     
     if chat_id:
-        query += " AND chat_id = ?"
+        query += " AND m.chat_id = ?"
         params.append(chat_id)
     
     if sender_id:
-        query += " AND sender_id = ?"
+        query += " AND m.sender_id = ?"
         params.append(sender_id)
     
     if is_pushed is not None:
-        query += " AND is_pushed = ?"
-        params.append(1 if is_pushed else 0)
+        # 直接写入常量，才能用上 is_pushed = 0 的部分索引
+        query += " AND m.is_pushed = 1" if is_pushed else " AND m.is_pushed = 0"
     
     if start_date:
-        query += " AND message_date >= ?"
+        query += " AND m.message_date >= ?"
         params.append(start_date.isoformat())
     
     if end_date:
-        query += " AND message_date <= ?"
+        query += " AND m.message_date <= ?"
         params.append(end_date.isoformat())
-    
-    query += " ORDER BY message_date DESC LIMIT ?"
-    params.append(limit)
-    
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    
-    # 获取列名
-    columns = [description[0] for description in cursor.description]
-    
-    # 转换为字典列表
-    results = []
-    for row in rows:
-        result = dict(zip(columns, row))
-        # 转换时间字符串为datetime对象
-        result['message_date'] = datetime.fromisoformat(result['message_date'])
-        result['created_at'] = datetime.fromisoformat(result['created_at'])
-        # 转换布尔值
-        result['is_pushed'] = bool(result['is_pushed'])
-        results.append(result)
-    
-    conn.close()
-    return results
+
+    first_page = query + " ORDER BY m.message_date DESC, m.id DESC LIMIT ?"
+    next_page = query + " AND (m.message_date, m.id) < (?, ?) ORDER BY m.message_date DESC, m.id DESC LIMIT ?"
+    cursor_params: List = []
+    remaining = limit
+
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        with read_conn() as conn:
+            cursor = conn.execute(next_page if cursor_params else first_page, [*params, *cursor_params, size])
+            rows = cursor.fetchall()
+            page = _rows(cursor, rows)
+        yield from page
+        if len(rows) < size:
+            return
+        if remaining is not None:
+            remaining -= len(rows)
+        # 游标使用原始的时间字符串，不需要解析
+        cursor_params = [page[-1].raw('message_date'), page[-1].raw('id')]
+
+def get_messages(
+    keyword: Optional[str] = None,
+    match_type: Optional[str] = None,
+    chat_id: Optional[int] = None,
+    sender_id: Optional[int] = None,
+    is_pushed: Optional[bool] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: int = 100,
+    columns: Optional[Sequence[str]] = None
+) -> List[MessageRow]:
+    """查询匹配的消息，最新的在前"""
+    return list(query_messages(
+        keyword, match_type, chat_id, sender_id, is_pushed, start_date, end_date,
+        limit=limit, columns=columns, page_size=limit
+    ))
+
+def iter_messages(
+    is_pushed: Optional[bool] = None,
+    after_id: int = 0,
+    page_size: int = 500,
+    columns: Optional[Sequence[str]] = None
+) -> Iterator[MessageRow]:
+    """按 id 从旧到新遍历消息
+
+    使用 id 作为游标分页读取，每页单独查询，不会长时间占用读事务，
+    查询代价与表的总行数无关。columns 指定只读取哪些列。
+    """
+    query = f"SELECT {message_select(columns, ('id',))} FROM messages m {MESSAGE_JOINS} WHERE m.id > ?"
+    if is_pushed is not None:
+        query += " AND m.is_pushed = 1" if is_pushed else " AND m.is_pushed = 0"
+    query += " ORDER BY m.id LIMIT ?"
+
+    while True:
+        with read_conn() as conn:
+            cursor = conn.execute(query, (after_id, page_size))
+            rows = cursor.fetchall()
+            page = _rows(cursor, rows)
+        yield from page
+        if len(rows) < page_size:
+            return
+        after_id = page[-1]['id']
+
+# trigram 分词最短能匹配的字符数
+FTS_MIN_TERM = 3
+
+def has_fts() -> bool:
+    """全文索引是否可用"""
+    with read_conn() as conn:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ).fetchone() is not None
+
+def _fts_query(terms: List[str]) -> str:
+    """把搜索词转换为 FTS5 查询：每个词作为一个短语，全部包含才算命中"""
+    return ' AND '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+def _like_pattern(term: str) -> str:
+    """包含 term 的 LIKE 模式，转义其中的通配符"""
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+# 名称命中某个词的会话和发送者的消息
+NAME_MATCH_SQL = '''
+    SELECT id FROM messages WHERE chat_id IN (
+        SELECT chat_id FROM chats WHERE title LIKE ? ESCAPE '\\'
+    )
+    UNION ALL
+    SELECT id FROM messages WHERE sender_id IN (
+        SELECT sender_id FROM senders WHERE name LIKE ? ESCAPE '\\'
+    )
+'''
+
+def _names_match(conn: sqlite3.Connection, term: str) -> bool:
+    """是否有会话名称或发送者名称包含 term"""
+    pattern = _like_pattern(term)
+    return conn.execute(
+        "SELECT EXISTS (SELECT 1 FROM chats WHERE title LIKE ? ESCAPE '\\') "
+        "OR EXISTS (SELECT 1 FROM senders WHERE name LIKE ? ESCAPE '\\')",
+        (pattern, pattern)
+    ).fetchone()[0] == 1
+
+def search_messages(text: str, before_id: Optional[int] = None, limit: int = 10) -> List[MessageRow]:
+    """全文搜索消息文本、发送者和群组名称，按时间从新到旧
+
+    before_id 为上一页最后一条的 id，用作游标翻页。每个词至少 3 个字符时走全文索引，
+    否则退回 LIKE 扫描。返回的每一项额外带有 snippet（命中处的文本片段）。
+    """
+    terms = text.split()
+    if not terms:
+        return []
+    before_id = before_id or (1 << 62)
+    use_fts = all(len(term) >= FTS_MIN_TERM for term in terms) and has_fts()
+
+    with read_conn() as conn:
+        # 全文索引只包含消息文本；命中名称的词改为“文本命中或名称命中”的条件
+        name_terms = [term for term in terms if _names_match(conn, term)] if use_fts else []
+        if use_fts and not name_terms:
+            cursor = conn.execute(f'''
+                SELECT {message_select()}, snippet(messages_fts, 0, '**', '**', '…', 24) AS snippet
+                FROM messages_fts f JOIN messages m ON m.id = f.rowid {MESSAGE_JOINS}
+                WHERE messages_fts MATCH ? AND f.rowid < ?
+                ORDER BY f.rowid DESC
+                LIMIT ?
+            ''', (_fts_query(terms), before_id, limit))
+        elif use_fts:
+            query = (
+                f"SELECT {message_select()}, substr(m.message_text, 1, 80) AS snippet "
+                f"FROM messages m {MESSAGE_JOINS} WHERE m.id < ?"
+            )
+            params: List = [before_id]
+            text_terms = [term for term in terms if term not in name_terms]
+            if text_terms:
+                query += " AND m.id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)"
+                params.append(_fts_query(text_terms))
+            for term in name_terms:
+                query += (
+                    " AND m.id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?"
+                    f" UNION ALL {NAME_MATCH_SQL})"
+                )
+                pattern = _like_pattern(term)
+                params += [_fts_query([term]), pattern, pattern]
+            query += " ORDER BY m.id DESC LIMIT ?"
+            params.append(limit)
+            cursor = conn.execute(query, params)
+        else:
+            query = (
+                f"SELECT {message_select()}, substr(m.message_text, 1, 80) AS snippet "
+                f"FROM messages m {MESSAGE_JOINS} WHERE m.id < ?"
+            )
+            params = [before_id]
+            for term in terms:
+                pattern = _like_pattern(term)
+                query += (
+                    " AND (m.message_text LIKE ? ESCAPE '\\'"
+                    " OR s.name LIKE ? ESCAPE '\\'"
+                    " OR c.title LIKE ? ESCAPE '\\')"
+                )
+                params += [pattern] * 3
+            query += " ORDER BY m.id DESC LIMIT ?"
+            params.append(limit)
+            cursor = conn.execute(query, params)
+        return _rows(cursor, cursor.fetchall())
+
+# 黑名单缓存，启动时从数据库加载，拉黑时同步更新
+_blocked_users: Set[int] = set()
+# 拉黑后的回调（分片模式下用于通知工作进程）
+on_block: Optional[Callable[[int], None]] = None
+
+def load_blacklist() -> int:
+    """从数据库加载黑名单到内存，返回数量"""
+    global _blocked_users
+    with read_conn() as conn:
+        rows = conn.execute('SELECT user_id FROM blacklist').fetchall()
+    _blocked_users = {row[0] for row in rows}
+    return len(_blocked_users)
+
+def remember_blocked(user_id: int) -> None:
+    """只更新内存中的黑名单（分片模式下工作进程收到拉黑通知时使用）"""
+    _blocked_users.add(user_id)
 
 def is_user_blocked(user_id: int) -> bool:
-    """检查用户是否在黑名单中"""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute('SELECT 1 FROM blacklist WHERE user_id = ?', (user_id,))
-    result = c.fetchone() is not None
-    conn.close()
-    return result
+    """检查用户是否在黑名单中（只查内存）"""
+    return user_id in _blocked_users
 
 def block_user(user_id: int) -> bool:
     """将用户加入黑名单"""
     try:
-        conn = get_conn()
-        c = conn.cursor()
-        c.execute('INSERT OR IGNORE INTO blacklist (user_id) VALUES (?)', (user_id,))
-        
-        # 标记该用户的所有未推送消息为已推送
-        c.execute('''
-            UPDATE messages 
-            SET is_pushed = 1 
-            WHERE sender_id = ? AND is_pushed = 0
-        ''', (user_id,))
-        
-        conn.commit()
-        conn.close()
+        with write_conn() as conn:
+            conn.execute('INSERT OR IGNORE INTO blacklist (user_id) VALUES (?)', (user_id,))
+            
+            # 标记该用户的所有未推送消息为已推送
+            conn.execute('''
+                UPDATE messages 
+                SET is_pushed = 1 
+                WHERE sender_id = ? AND is_pushed = 0
+            ''', (user_id,))
+
+            # 取消该用户尚未送达的推送任务
+            conn.execute('''
+                DELETE FROM deliveries
+                WHERE state IN ('pending', 'claimed')
+                  AND message_rowid IN (SELECT id FROM messages WHERE sender_id = ?)
+            ''', (user_id,))
+        _blocked_users.add(user_id)
+        if on_block is not None:
+            on_block(user_id)
         return True
     except Exception as e:
-        print(f"加入黑名单失败: {e}")
+        logger.error(f"加入黑名单失败: {e}")
         return False
 
 # 初始化数据库
 init_db()
+load_blacklist()
+
+# 全局写入队列
+message_writer = MessageWriter(WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL, WRITE_QUEUE_SIZE)
@@ -0,0 +1,134 @@
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from config import (
+    DEDUP_CACHE_SIZE, DEDUP_TTL,
+    NEAR_DUP_WINDOW, NEAR_DUP_DISTANCE, NEAR_DUP_MIN_LENGTH
+)
+from db import enqueue_message, enqueue_sighting, enqueue_occurrence, dedup_scope
+from simhash import SimHashIndex, normalize, simhash
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """带过期时间的 LRU 缓存"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取缓存，不存在或已过期返回 None"""
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """写入缓存，并淘汰超出容量或已过期的旧数据"""
+        now = time.monotonic()
+        self._items[key] = (now + self.ttl, value)
+        self._items.move_to_end(key)
+
+        items = self._items
+        while items:
+            oldest_key, (expires_at, _) = next(iter(items.items()))
+            if len(items) <= self.max_size and expires_at >= now:
+                break
+            del items[oldest_key]
+
+
+# 已处理过的消息：(chat_id, message_id, 去重范围) -> 是否匹配到关键词
+seen_messages = TTLCache(DEDUP_CACHE_SIZE, DEDUP_TTL)
+
+
+# 近似重复检测：同一段广告稍作改动后发到多个群，只推送一次
+near_duplicates = SimHashIndex(NEAR_DUP_DISTANCE, NEAR_DUP_WINDOW)
+
+# 合并到近似重复原消息的消息键，这些消息没有保存，其他监听号看到时不记录
+collapsed_messages = TTLCache(DEDUP_CACHE_SIZE, DEDUP_TTL)
+
+
+# 分片模式下工作进程不写库，匹配结果经由该回调发给主进程
+_forward: Optional[Callable[[Tuple], Awaitable[None]]] = None
+
+
+def forward_to(send: Optional[Callable[[Tuple], Awaitable[None]]]) -> None:
+    """设置匹配结果的转发目标，None 表示在本进程中写库"""
+    global _forward
+    _forward = send
+
+
+def message_key(chat_id: int, message_id: int, chat_type: str, client_id: int) -> Tuple[int, int, int]:
+    """跨监听号去重使用的消息键"""
+    return chat_id, message_id, dedup_scope(chat_type, client_id)
+
+
+async def submit_sighting(key: Tuple[int, int, int], client_id: int) -> None:
+    """其他监听号已处理过的匹配消息，只记录本账号也看到了"""
+    if _forward is not None:
+        await _forward(('sighting', key, client_id))
+        return
+    if collapsed_messages.get(key):
+        return
+    await enqueue_sighting(*key, client_id)
+
+
+async def submit_match(record: Dict) -> None:
+    """保存首次出现的匹配消息，并记录看到它的监听号
+
+    窗口期内的近似重复消息不再单独保存和推送，只累加首条消息的出现次数。
+    """
+    if _forward is not None:
+        await _forward(('match', record))
+        return
+
+    key = message_key(record['chat_id'], record['message_id'], record['chat_type'], record['client_id'])
+    # 分片模式下另一个工作进程也可能提交已合并的消息，不重复累加
+    if collapsed_messages.get(key):
+        return
+
+    fingerprint = None
+    if NEAR_DUP_WINDOW > 0:
+        normalized = normalize(record['message_text'])
+        if len(normalized) >= NEAR_DUP_MIN_LENGTH:
+            fingerprint = simhash(normalized)
+            original = near_duplicates.find(fingerprint)
+            if original is not None and original != key:
+                await enqueue_occurrence(*original)
+                collapsed_messages.put(key, True)
+                logger.info(f"近似重复消息已合并: {record['chat_title']} - {record['matched_keyword']}")
+                return
+
+    await enqueue_message(**record)
+    await enqueue_sighting(*key, record['client_id'])
+    if fingerprint is not None:
+        near_duplicates.add(fingerprint, key)
+    logger.info(
+        f"关键词匹配成功[{record['match_type']}]: {record['chat_title']} - "
+        f"{record['matched_keyword']} - {record['message_text'][:5]}..."
+    )
+
+
+async def submit_forwarded(item: Tuple) -> None:
+    """处理工作进程转发来的匹配结果"""
+    kind = item[0]
+    if kind == 'match':
+        await submit_match(item[1])
+    elif kind == 'sighting':
+        await submit_sighting(tuple(item[1]), item[2])
+    else:
+        logger.warning(f"未知的转发消息类型: {kind}")
@@ -0,0 +1,224 @@
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from config import KEYWORDS_FILE, load_json, save_json
+from matcher import ChainedMatcher, KeywordMatcher, Matcher
+from priority import DEFAULT_PRIORITY
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class KeywordSnapshot(NamedTuple):
+    """关键词集合的不可变快照"""
+    version: int
+    exact: Tuple[str, ...]
+    fuzzy: Tuple[str, ...]
+    matcher: KeywordMatcher
+    # 会话规则：忽略的会话、只监听的会话（为空表示不限制）、会话专属关键词
+    ignored_chats: FrozenSet[int] = frozenset()
+    allowed_chats: FrozenSet[int] = frozenset()
+    chat_keywords: Dict[int, Dict[str, Tuple[str, ...]]] = {}
+    # 有专属关键词的会话 -> 共用的全局匹配器加只含专属关键词的匹配器
+    chat_matchers: Dict[int, ChainedMatcher] = {}
+    # 单独设置了推送优先级的关键词
+    priorities: Dict[str, int] = {}
+
+    def priority(self, keyword: str, match_type: str) -> int:
+        """关键词的推送优先级"""
+        return self.priorities.get(keyword, DEFAULT_PRIORITY[match_type])
+
+    def matcher_for(self, chat_id: int) -> Optional[Matcher]:
+        """会话使用的匹配器，该会话的消息不需要处理时返回 None"""
+        if chat_id in self.ignored_chats:
+            return None
+        matcher = self.chat_matchers.get(chat_id)
+        if matcher is not None:
+            return matcher
+        if self.allowed_chats and chat_id not in self.allowed_chats:
+            return None
+        return self.matcher
+
+
+class KeywordStore:
+    """进程内关键词存储
+
+    启动时加载一次 keywords.json，之后匹配只读取内存中的快照。
+    机器人增删关键词时直接更新快照；手动修改文件则由 check_reload 按修改时间兜底重新加载。
+
+    keywords.json 中除全局的 exact、fuzzy 外，还可以包含会话规则：
+    ignored_chats 忽略的会话，allowed_chats 只监听的会话，
+    chats 会话专属关键词（{"会话ID": {"exact": [...], "fuzzy": [...]}}），
+    priorities 关键词的推送优先级（{"关键词": 0-2}，未设置时完全匹配为普通、模糊匹配为低）。
+    """
+
+    def __init__(self, file_path: Path):
+        self._file_path = file_path
+        self._lock = threading.RLock()
+        self._mtime: Optional[int] = None
+        self._snapshot: Optional[KeywordSnapshot] = None
+        # 关键词变化后的回调（分片模式下用于通知工作进程）
+        self.on_change: Optional[Callable[[], None]] = None
+
+    @property
+    def snapshot(self) -> KeywordSnapshot:
+        """当前快照，首次访问时从文件加载"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.load()
+        return snapshot
+
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self._file_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _publish(self, keywords: Dict[str, Any]) -> KeywordSnapshot:
+        """构建新的匹配器并替换当前快照"""
+        version = self._snapshot.version + 1 if self._snapshot else 1
+        exact = keywords.get("exact", [])
+        fuzzy = keywords.get("fuzzy", [])
+
+        matcher = KeywordMatcher(exact, fuzzy)
+        chat_keywords = {}
+        chat_matchers = {}
+        for chat_id, scoped in keywords.get("chats", {}).items():
+            scoped_exact = tuple(scoped.get("exact", []))
+            scoped_fuzzy = tuple(scoped.get("fuzzy", []))
+            if not scoped_exact and not scoped_fuzzy:
+                continue
+            chat_keywords[int(chat_id)] = {"exact": scoped_exact, "fuzzy": scoped_fuzzy}
+            chat_matchers[int(chat_id)] = ChainedMatcher(matcher, KeywordMatcher(scoped_exact, scoped_fuzzy))
+
+        snapshot = KeywordSnapshot(
+            version=version,
+            exact=tuple(exact),
+            fuzzy=tuple(fuzzy),
+            matcher=matcher,
+            ignored_chats=frozenset(int(c) for c in keywords.get("ignored_chats", [])),
+            allowed_chats=frozenset(int(c) for c in keywords.get("allowed_chats", [])),
+            chat_keywords=chat_keywords,
+            chat_matchers=chat_matchers,
+            priorities={keyword: int(level) for keyword, level in keywords.get("priorities", {}).items()}
+        )
+        self._snapshot = snapshot
+        if self.on_change is not None:
+            self.on_change()
+        return snapshot
+
+    def load(self) -> KeywordSnapshot:
+        """从文件加载关键词"""
+        with self._lock:
+            mtime = self._file_mtime()
+            keywords = load_json(self._file_path, default={"exact": [], "fuzzy": []})
+            self._mtime = mtime
+            snapshot = self._publish(keywords)
+        logger.info(
+            f"关键词已加载: 版本 {snapshot.version}, 共 {len(snapshot.matcher)} 个，"
+            f"{len(snapshot.chat_keywords)} 个会话有专属关键词，忽略 {len(snapshot.ignored_chats)} 个会话"
+        )
+        return snapshot
+
+    def check_reload(self) -> bool:
+        """文件被手动修改时重新加载，返回是否发生了重新加载"""
+        if self._snapshot is not None and self._file_mtime() == self._mtime:
+            return False
+        self.load()
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        """以 keywords.json 的格式返回当前关键词和会话规则"""
+        snapshot = self.snapshot
+        return {
+            "exact": list(snapshot.exact),
+            "fuzzy": list(snapshot.fuzzy),
+            "ignored_chats": sorted(snapshot.ignored_chats),
+            "allowed_chats": sorted(snapshot.allowed_chats),
+            "chats": {
+                str(chat_id): {"exact": list(scoped["exact"]), "fuzzy": list(scoped["fuzzy"])}
+                for chat_id, scoped in snapshot.chat_keywords.items()
+            },
+            "priorities": dict(snapshot.priorities)
+        }
+
+    def _save(self, keywords: Dict[str, Any]) -> None:
+        save_json(self._file_path, keywords)
+        self._mtime = self._file_mtime()
+        self._publish(keywords)
+
+    def add(self, keyword: str, match_type: str, chat_id: Optional[int] = None) -> bool:
+        """添加关键词，指定 chat_id 时只在该会话生效，已存在时返回 False"""
+        with self._lock:
+            keywords = self.to_dict()
+            if chat_id is None:
+                target = keywords
+            else:
+                target = keywords["chats"].setdefault(str(chat_id), {"exact": [], "fuzzy": []})
+            if keyword in target["exact"] or keyword in target["fuzzy"]:
+                return False
+            target[match_type].append(keyword)
+            self._save(keywords)
+        return True
+
+    def remove(self, keyword: str, match_type: str, chat_id: Optional[int] = None) -> bool:
+        """删除关键词，不存在时返回 False"""
+        with self._lock:
+            keywords = self.to_dict()
+            if chat_id is None:
+                target = keywords
+            else:
+                target = keywords["chats"].get(str(chat_id))
+            if target is None or keyword not in target[match_type]:
+                return False
+            target[match_type].remove(keyword)
+            if chat_id is not None and not target["exact"] and not target["fuzzy"]:
+                del keywords["chats"][str(chat_id)]
+            if keyword in keywords["priorities"] and keyword not in self._all_keywords(keywords):
+                del keywords["priorities"][keyword]
+            self._save(keywords)
+        return True
+
+    @staticmethod
+    def _all_keywords(keywords: Dict[str, Any]) -> List[str]:
+        result = keywords["exact"] + keywords["fuzzy"]
+        for scoped in keywords["chats"].values():
+            result += scoped["exact"] + scoped["fuzzy"]
+        return result
+
+    def set_priority(self, keyword: str, priority: int) -> bool:
+        """设置关键词的推送优先级，关键词不存在时返回 False"""
+        with self._lock:
+            keywords = self.to_dict()
+            if keyword not in self._all_keywords(keywords):
+                return False
+            keywords["priorities"][keyword] = priority
+            self._save(keywords)
+        return True
+
+    def add_chat(self, rule: str, chat_id: int) -> bool:
+        """将会话加入 ignored_chats 或 allowed_chats，已存在时返回 False"""
+        with self._lock:
+            keywords = self.to_dict()
+            if chat_id in keywords[rule]:
+                return False
+            keywords[rule].append(chat_id)
+            self._save(keywords)
+        return True
+
+    def remove_chat(self, rule: str, chat_id: int) -> bool:
+        """将会话移出 ignored_chats 或 allowed_chats，不存在时返回 False"""
+        with self._lock:
+            keywords = self.to_dict()
+            if chat_id not in keywords[rule]:
+                return False
+            keywords[rule].remove(chat_id)
+            self._save(keywords)
+        return True
+
+
+# 全局关键词存储
+keyword_store = KeywordStore(KEYWORDS_FILE)
@@ -1,6 +1,5 @@
 import logging
 import asyncio
-from typing import Dict, List
 
 from pyrogram import Client, idle
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -8,9 +7,20 @@ from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.jobstores.memory import MemoryJobStore
 from config import (
     API_ID, API_HASH, BOT_TOKEN,
-    SESSIONS_FILE, load_json
+    KEYWORDS_RELOAD_INTERVAL, SHARDS,
+    METRICS_HOST, METRICS_PORT, RECORD_UPDATES,
+    RETENTION_DAYS, RETENTION_INTERVAL, RAW_ARCHIVE_DAYS
 )
-from bot.push import push_task, PUSH_INTERVAL
+import db
+import metrics
+from keywords import keyword_store
+from db import message_writer, close_db, count_pending_pushes
+from bot.push import push_worker, notify_push, PUSH_SWEEP_INTERVAL
+from supervisor import supervisor
+from shard import ShardCoordinator
+from recorder import recorder
+from retention import run_retention
+import rawarchive
 
 
 import os
@@ -20,9 +30,6 @@ os.environ['TZ'] = 'Asia/Shanghai'
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 活动的客户端
-active_clients: Dict[str, Client] = {}
-
 # 定时任务调度器
 scheduler = AsyncIOScheduler(
     jobstores={'default': MemoryJobStore()},
@@ -30,63 +37,13 @@ scheduler = AsyncIOScheduler(
     timezone='Asia/Shanghai'
 )
 
-async def start_client(phone: str, name: str = None) -> bool:
-    """启动单个客户端"""
-    try:
-        if phone in active_clients:
-            logger.warning(f"监听号 {phone} 已经在运行中")
-            return True
-
-        client = Client(
-            name=f"user_{phone.replace('+', '')}",
-            api_id=API_ID,
-            api_hash=API_HASH,
-            workdir="data",
-            plugins=dict(root="user")
-        )
-        await client.start()
-        active_clients[phone] = client
-        logger.info(f"监听号 {phone} ({name or '未命名'}) 已启动")
-        return True
-    except Exception as e:
-        logger.error(f"启动监听号 {phone} 失败: {str(e)}")
-        return False
-
-async def stop_client(phone: str) -> bool:
-    """停止单个客户端"""
-    try:
-        if phone not in active_clients:
-            logger.warning(f"监听号 {phone} 未在运行")
-            return True
-
-        client = active_clients[phone]
-        await client.stop()
-        del active_clients[phone]
-        logger.info(f"监听号 {phone} 已停止")
-        return True
-    except Exception as e:
-        logger.error(f"停止监听号 {phone} 失败: {str(e)}")
-        return False
-
-async def check_sessions() -> None:
-    """检查 sessions.json 的变化"""
-    try:
-        # 读取当前配置的监听号
-        sessions = load_json(SESSIONS_FILE, default=[])
-        configured_phones = {s['phone']: s.get('name') for s in sessions}
-        active_phones = set(active_clients.keys())
-
-        # 停止已删除的监听号
-        for phone in active_phones - configured_phones.keys():
-            await stop_client(phone)
+async def retention_job():
+    """归档过期消息，在线程池中分批执行，不阻塞事件循环"""
+    await asyncio.get_running_loop().run_in_executor(None, run_retention)
 
-        # 启动新添加的监听号
-        for phone, name in configured_phones.items():
-            if phone not in active_phones:
-                await start_client(phone, name)
-
-    except Exception as e:
-        logger.error(f"检查监听号状态失败: {str(e)}")
+async def prune_raw_archive_job():
+    """删除超过 RAW_ARCHIVE_DAYS 天的原始消息分段"""
+    await asyncio.get_running_loop().run_in_executor(None, rawarchive.prune)
 
 async def main():
     # 创建所有客户端
@@ -99,36 +56,90 @@ async def main():
         plugins=dict(root="bot")
     )
 
+    # 加载关键词，启动消息写入线程
+    keyword_store.load()
+    message_writer.start()
+
+    # 指标服务
+    metrics.write_queue_depth.set_function(lambda: message_writer.depth)
+    metrics.pending_pushes.set_function(count_pending_pushes)
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+
     # 启动机器人
     await bot.start()
     logger.info("机器人已启动")
 
-    # 启动所有监听号
-    await check_sessions()
-
-    # 启动定时任务
+    # 录制群消息（分片模式下由各工作进程录制）
+    if RECORD_UPDATES and SHARDS == 1:
+        recorder.start()
+
+    if SHARDS > 1:
+        # 分片模式：监听号在工作进程中运行，本进程只负责写库和推送
+        coordinator = ShardCoordinator(SHARDS)
+        supervisor.on_notify = lambda: coordinator.broadcast(('sessions',))
+        keyword_store.on_change = lambda: coordinator.broadcast(('keywords',))
+        db.on_block = lambda user_id: coordinator.broadcast(('block', user_id))
+        coordinator.start()
+        supervisor_task = asyncio.create_task(coordinator.run())
+        logger.info(f"已启动 {SHARDS} 个分片进程")
+    else:
+        # 启动所有监听号，之后由 bot 增删监听号时通知同步，并定期检查连接状态
+        coordinator = None
+        await supervisor.reconcile()
+        supervisor_task = asyncio.create_task(supervisor.run())
+
+    # 关键词文件被手动修改时重新加载
     scheduler.add_job(
-        check_sessions,
-        trigger=IntervalTrigger(seconds=30),
-        id='check_sessions',
-        name='检查监听号状态',
+        keyword_store.check_reload,
+        trigger=IntervalTrigger(seconds=KEYWORDS_RELOAD_INTERVAL),
+        id='reload_keywords',
+        name='检查关键词文件',
         replace_existing=True,
         coalesce=True,
         max_instances=1
     )
-    
-    # 添加推送任务
+
+    # 推送协程：消息写入后立即被唤醒
+    message_writer.on_flush = notify_push
+    push_worker_task = asyncio.create_task(push_worker(bot))
+
+    # 兜底扫描：处理崩溃后遗留的未推送消息
     scheduler.add_job(
-        push_task,
-        trigger=IntervalTrigger(seconds=PUSH_INTERVAL),
-        id='push_messages',
-        name='推送匹配消息',
+        notify_push,
+        trigger=IntervalTrigger(seconds=PUSH_SWEEP_INTERVAL),
+        id='sweep_messages',
+        name='扫描未推送消息',
         replace_existing=True,
         coalesce=True,
-        max_instances=1,
-        args=[bot]  # 传入机器人客户端
+        max_instances=1
     )
     
+    # 定期归档过期消息
+    if RETENTION_DAYS > 0:
+        scheduler.add_job(
+            retention_job,
+            trigger=IntervalTrigger(seconds=RETENTION_INTERVAL),
+            id='retention',
+            name='归档过期消息',
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+
+    # 每天清理过期的原始消息归档
+    if RAW_ARCHIVE_DAYS > 0:
+        scheduler.add_job(
+            prune_raw_archive_job,
+            trigger=IntervalTrigger(days=1),
+            id='prune_raw_archive',
+            name='清理原始消息归档',
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+
     scheduler.start()
     logger.info("定时任务已启动")
 
@@ -140,13 +151,40 @@ async def main():
         logger.info("定时任务已停止")
 
         # 停止所有监听号
-        for phone in list(active_clients.keys()):
-            await stop_client(phone)
+        if coordinator is not None:
+            # 分片模式下接收循环不能取消，等它处理完当前一批后再停止工作进程
+            await coordinator.stop(supervisor_task)
+        else:
+            supervisor_task.cancel()
+            try:
+                await supervisor_task
+            except asyncio.CancelledError:
+                pass
+            await supervisor.shutdown()
         logger.info("所有监听号已停止")
+        recorder.stop()
+
+        # 写完队列中剩余的消息
+        message_writer.stop()
+        logger.info("消息写入队列已清空")
+
+        # 停止推送协程
+        push_worker_task.cancel()
+        try:
+            await push_worker_task
+        except asyncio.CancelledError:
+            pass
 
         # 停止机器人
         await bot.stop()
         logger.info("机器人已停止")
 
+        # 停止指标服务
+        if metrics_server is not None:
+            metrics_server.close()
+
+        # 关闭数据库连接
+        close_db()
+
 if __name__ == "__main__":
     asyncio.run(main())
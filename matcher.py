@@ -0,0 +1,125 @@
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+# 未命中时的优先级（比任何关键词下标都大）
+_NO_MATCH = 1 << 62
+
+
+class KeywordMatcher:
+    """编译好的关键词匹配器
+
+    精确匹配使用哈希表查找，模糊匹配使用 Aho-Corasick 自动机，
+    对消息文本只扫描一遍，耗时与关键词数量无关。
+    返回结果与逐个关键词按列表顺序匹配完全一致。
+    """
+
+    def __init__(self, exact_keywords: Sequence[str], fuzzy_keywords: Sequence[str]):
+        # 精确匹配：小写关键词 -> 原始关键词（重复时保留排在前面的）
+        self._exact: Dict[str, str] = {}
+        for keyword in exact_keywords:
+            self._exact.setdefault(keyword.lower(), keyword)
+
+        # 模糊匹配：自动机节点的转移表、失败指针、命中的最小关键词下标
+        self._fuzzy: List[str] = list(fuzzy_keywords)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[int] = [_NO_MATCH]
+        # 空关键词对任意文本都命中
+        self._empty = _NO_MATCH
+
+        for index, keyword in enumerate(self._fuzzy):
+            self._insert(keyword.lower(), index)
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self._exact) + len(self._fuzzy)
+
+    def _insert(self, pattern: str, index: int) -> None:
+        """将模糊关键词加入字典树"""
+        if not pattern:
+            self._empty = min(self._empty, index)
+            return
+
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(_NO_MATCH)
+                self._goto[state][ch] = next_state
+            state = next_state
+        self._out[state] = min(self._out[state], index)
+
+    def _build(self) -> None:
+        """按层构建失败指针，并把后缀节点的命中结果合并到当前节点"""
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[next_state] = fail
+                self._out[next_state] = min(self._out[next_state], self._out[fail])
+                queue.append(next_state)
+
+    def match(self, text: str) -> Optional[Tuple[str, str]]:
+        """匹配关键词，返回 (匹配到的关键词, 匹配模式)"""
+        if not text:
+            return None
+
+        text = text.lower()
+
+        # 1. 先尝试精确匹配
+        keyword = self._exact.get(text)
+        if keyword is not None:
+            return keyword, "exact"
+
+        # 2. 再尝试模糊匹配，取列表中最靠前的命中关键词
+        best = self._empty
+        if best and len(self._goto) > 1:
+            goto, fail, out = self._goto, self._fail, self._out
+            state = 0
+            for ch in text:
+                next_state = goto[state].get(ch)
+                while next_state is None and state:
+                    state = fail[state]
+                    next_state = goto[state].get(ch)
+                state = next_state or 0
+                if out[state] < best:
+                    best = out[state]
+                    if not best:
+                        break
+
+        if best == _NO_MATCH:
+            return None
+        return self._fuzzy[best], "fuzzy"
+
+
+class ChainedMatcher:
+    """全局匹配器加会话专属匹配器
+
+    返回结果与把两组关键词按“全局在前、专属在后”合成一个 KeywordMatcher 完全一致：
+    精确匹配优先，同为模糊匹配时全局关键词排在前面。全局匹配器在所有会话间共用。
+    """
+
+    def __init__(self, first: KeywordMatcher, second: KeywordMatcher):
+        self._first = first
+        self._second = second
+
+    def __len__(self) -> int:
+        return len(self._first) + len(self._second)
+
+    def match(self, text: str) -> Optional[Tuple[str, str]]:
+        """匹配关键词，返回 (匹配到的关键词, 匹配模式)"""
+        first = self._first.match(text)
+        if first is not None and first[1] == "exact":
+            return first
+        second = self._second.match(text)
+        if second is not None and (first is None or second[1] == "exact"):
+            return second
+        return first
+
+
+Matcher = Union[KeywordMatcher, ChainedMatcher]
@@ -0,0 +1,303 @@
+import bisect
+import logging
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 耗时类直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+# 推送延迟的分桶（秒）
+LAG_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600)
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Metric(ABC):
+    """指标基类，按标签值分别记录，写入可在任意线程中进行
+
+    分片模式下工作进程定期上报自己的快照（见 set_remote），计入 value、items、quantile
+    等读取结果（/stats 使用），但不在本进程的 /metrics 中输出，避免与工作进程自己的端口重复。
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        # 其他进程上报的快照：进程序号 -> snapshot() 的结果
+        self._remote: Dict[int, Any] = {}
+        registry.append(self)
+
+    def snapshot(self) -> Any:
+        """可以发送给其他进程的当前值"""
+        return None
+
+    def set_remote(self, source: int, data: Any) -> None:
+        """记录其他进程上报的快照，替换该进程之前上报的快照"""
+        with self._lock:
+            self._remote[source] = data
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Prometheus 文本格式的样本行"""
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """只增不减的计数器"""
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self) -> Dict[Labels, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def _totals(self) -> Dict[Labels, float]:
+        """本进程与其他进程上报的值之和"""
+        with self._lock:
+            totals = dict(self._values)
+            for remote in self._remote.values():
+                for labels, value in remote.items():
+                    totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def value(self, labels: Optional[Labels] = None) -> float:
+        """指定标签的值，不指定时返回所有标签之和"""
+        totals = self._totals()
+        if labels is not None:
+            return totals.get(labels, 0)
+        return sum(totals.values())
+
+    def items(self) -> List[Tuple[Labels, float]]:
+        return sorted(self._totals().items())
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}'
+            for labels, value in items
+        ]
+
+
+class Gauge(Metric):
+    """当前值，可以直接设置，也可以在采集时调用 func 读取"""
+
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, func: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation)
+        self.func = func
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def set_function(self, func: Callable[[], float]) -> None:
+        self.func = func
+
+    def value(self) -> float:
+        if self.func is None:
+            return self._value
+        try:
+            return self.func()
+        except Exception as e:
+            logger.error(f"读取指标 {self.name} 失败: {e}")
+            return float('nan')
+
+    def samples(self) -> List[str]:
+        return [f'{self.name} {_format_value(self.value())}']
+
+
+class Histogram(Metric):
+    """分桶直方图，另外记录总和与次数"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数（不累计，最后一个为 +Inf）, 总和]
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            item = self._values.get(labels)
+            if item is None:
+                item = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            item[0][index] += 1
+            item[1][0] += value
+
+    def snapshot(self) -> Dict[Labels, Tuple[List[int], List[float]]]:
+        with self._lock:
+            return {labels: (list(c), list(s)) for labels, (c, s) in self._values.items()}
+
+    def _merged(self, labels: Optional[Labels]) -> Tuple[List[int], float]:
+        """合并各标签（含其他进程上报的值）的分桶计数和总和"""
+        with self._lock:
+            items = []
+            for values in (self._values, *self._remote.values()):
+                if labels is None:
+                    items.extend(values.values())
+                elif labels in values:
+                    items.append(values[labels])
+            counts = [0] * (len(self.buckets) + 1)
+            total = 0.0
+            for bucket_counts, value_sum in items:
+                for i, count in enumerate(bucket_counts):
+                    counts[i] += count
+                total += value_sum[0]
+        return counts, total
+
+    def count(self, labels: Optional[Labels] = None) -> int:
+        return sum(self._merged(labels)[0])
+
+    def quantile(self, q: float, labels: Optional[Labels] = None) -> Optional[float]:
+        """按分桶线性插值估算分位数，没有数据时返回 None"""
+        counts, _ = self._merged(labels)
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((labels, (list(c), s[0])) for labels, (c, s) in self._values.items())
+        lines = []
+        for labels, (counts, value_sum) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = _format_labels(self.label_names, labels, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f'{self.name}_sum{label_text} {_format_value(value_sum)}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+# 本进程注册的所有指标
+registry: List[Metric] = []
+
+
+def render() -> str:
+    """Prometheus 文本格式的全部指标"""
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+def export(metrics: Sequence[Metric]) -> Dict[str, Any]:
+    """指标快照，按指标名发送给主进程"""
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+
+def import_remote(source: int, data: Dict[str, Any]) -> None:
+    """记录工作进程 source 上报的指标快照"""
+    by_name = {metric.name: metric for metric in registry}
+    for name, snapshot in data.items():
+        metric = by_name.get(name)
+        if metric is not None:
+            metric.set_remote(source, snapshot)
+
+
+# 采集
+messages_seen = Counter('ml_messages_seen_total', '监听号收到的群组/频道消息数', ('client',))
+messages_matched = Counter('ml_messages_matched_total', '匹配到关键词的消息数', ('match_type',))
+match_seconds = Histogram('ml_match_seconds', '单条消息关键词匹配耗时')
+# 分片模式下在工作进程中采集、定期上报给主进程的指标
+SHARD_METRICS = (messages_seen, messages_matched, match_seconds)
+
+# 写库
+db_write_seconds = Histogram('ml_db_write_seconds', '写线程每个批次的写入耗时')
+db_rows_written = Counter('ml_db_rows_written_total', '写线程写入的语句数')
+write_queue_depth = Gauge('ml_write_queue_depth', '写入队列中等待写入的数量')
+
+# 推送
+pending_pushes = Gauge('ml_pending_pushes', '尚未送达的推送任务数（含未拆分的新消息）')
+pushes = Counter('ml_pushes_total', '推送结果', ('result',))
+push_messages = Counter('ml_push_messages_total', '实际发出的推送消息数，汇总推送时一条包含多个任务', ('kind',))
+push_shed = Counter('ml_push_shed_total', '推送积压时跳过的低优先级任务数')
+push_lag_seconds = Histogram('ml_push_lag_seconds', '从消息发出到推送成功的延迟', buckets=LAG_BUCKETS)
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # 跳过请求头
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 5)
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+        parts = request_line.split()
+        path = parts[1].split(b'?')[0] if len(parts) > 1 else b'/'
+        if path == b'/metrics':
+            # 部分指标在采集时查询数据库，放到线程池中执行
+            body = (await asyncio.get_running_loop().run_in_executor(None, render)).encode()
+            status = '200 OK'
+        else:
+            body = b'not found\n'
+            status = '404 Not Found'
+
+        writer.write(
+            f'HTTP/1.1 {status}\r\n'
+            f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug(f"指标请求处理失败: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.AbstractServer:
+    """在本地启动指标 HTTP 服务，Prometheus 从 /metrics 采集"""
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info(f"指标服务已启动: http://{host}:{port}/metrics")
+    return server
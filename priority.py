@@ -0,0 +1,7 @@
+# 推送优先级：数值越大越先推送；推送积压超过 PUSH_BACKLOG_LIMIT 时，低优先级的任务会被汇总或丢弃
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+PRIORITY_NAMES = {PRIORITY_HIGH: "高", PRIORITY_NORMAL: "普通", PRIORITY_LOW: "低"}
+# 没有单独设置时按匹配模式取默认优先级
+DEFAULT_PRIORITY = {"exact": PRIORITY_NORMAL, "fuzzy": PRIORITY_LOW}
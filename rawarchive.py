@@ -0,0 +1,194 @@
+"""原始消息归档与关键词回溯
+
+RAW_ARCHIVE_DAYS > 0 时开启录制（见 recorder.py），监听号收到的每条群消息都写入
+RECORD_DIR 下的压缩分段。每个分段关闭时附带一个索引（收到时间范围、各会话的消息数），
+按天汇总为会话索引：会话 ID -> 包含该会话消息的分段。
+
+新增关键词后用 backfill 对最近 N 天的分段批量匹配，命中的消息流式写入 messages，
+不会一次性读入内存。
+"""
+import json
+import time
+import logging
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import RECORD_DIR, RAW_ARCHIVE_DAYS
+from keywords import keyword_store
+from db import execute_statements, message_statements, is_user_blocked, write_conn
+from matcher import KeywordMatcher
+from recorder import index_path, read_index, read_segment, segment_paths
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 回溯时每批写入的条数
+BACKFILL_BATCH_SIZE = 500
+
+
+def _day_range(day: date) -> Tuple[float, float]:
+    start = datetime.combine(day, datetime.min.time()).timestamp()
+    return start, start + 86400
+
+
+def _segments(directory: Path) -> List[Tuple[Path, Optional[Dict]]]:
+    """所有分段及其索引，写入中的分段索引为 None"""
+    return [(path, read_index(path)) for path in segment_paths([directory])]
+
+
+def _overlaps(summary: Optional[Dict], since: float, until: float) -> bool:
+    # 没有索引的分段无法判断，只能读取
+    return summary is None or (summary['last'] >= since and summary['first'] < until)
+
+
+def day_index(day: date, directory: Path = RECORD_DIR,
+              segments: Optional[List[Tuple[Path, Optional[Dict]]]] = None) -> Dict[int, List[str]]:
+    """某一天的会话索引：会话 ID -> 分段文件名
+
+    已经结束的日期汇总后缓存到 index/YYYY-MM-DD.json，之后直接读取。
+    """
+    cache = directory / 'index' / f'{day.isoformat()}.json'
+    if cache.exists():
+        with open(cache, encoding='utf-8') as f:
+            return {int(chat_id): names for chat_id, names in json.load(f).items()}
+
+    since, until = _day_range(day)
+    index: Dict[int, List[str]] = {}
+    complete = True
+    for path, summary in segments if segments is not None else _segments(directory):
+        if summary is None:
+            # 没有索引的分段可能还在写入这一天的消息
+            if path.stat().st_mtime >= since:
+                complete = False
+            continue
+        if not _overlaps(summary, since, until):
+            continue
+        for chat_id in summary['chats']:
+            index.setdefault(chat_id, []).append(path.name)
+
+    # 当天或仍有分段在写入时不缓存
+    if complete and until <= time.time():
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+    return index
+
+
+def segments_for(since: float, chat_id: Optional[int] = None, directory: Path = RECORD_DIR) -> List[Path]:
+    """since 之后需要读取的分段，指定会话时通过每日会话索引跳过无关分段"""
+    segments = _segments(directory)
+    if chat_id is None:
+        return [path for path, summary in segments if _overlaps(summary, since, float('inf'))]
+
+    names = set()
+    day = datetime.fromtimestamp(since).date()
+    while day <= date.today():
+        names.update(day_index(day, directory, segments).get(chat_id, ()))
+        day += timedelta(days=1)
+    return [
+        path for path, summary in segments
+        if (summary is None or path.name in names) and _overlaps(summary, since, float('inf'))
+    ]
+
+
+def iter_archived(since: float, chat_id: Optional[int] = None, directory: Path = RECORD_DIR) -> Iterator[Dict]:
+    """按分段顺序读取 since 之后收到的消息"""
+    for path in segments_for(since, chat_id, directory):
+        for record in read_segment(path):
+            if record['recv'] < since:
+                continue
+            if chat_id is not None and record['chat_id'] != chat_id:
+                continue
+            yield record
+
+
+def _flush(statements: List[Tuple[str, Tuple]]) -> int:
+    """写入一批回溯结果，返回实际新增的条数（已存在的消息被忽略）"""
+    if not statements:
+        return 0
+    with write_conn() as conn:
+        inserted = execute_statements(conn, statements)
+    statements.clear()
+    return inserted
+
+
+def backfill(keyword: str, match_type: str, days: int = RAW_ARCHIVE_DAYS,
+             chat_id: Optional[int] = None, directory: Path = RECORD_DIR) -> Tuple[int, int, int]:
+    """用一个关键词回溯最近 days 天的原始消息，返回 (扫描条数, 命中条数, 新增条数)
+
+    回溯到的消息标记为已推送，不会补发给管理员，可以通过 /search 查看。
+    归档中的会话和发送者名称可能已经过时，只在数据库中没有时写入。
+    与实时匹配一样遵守会话规则，忽略的会话和不在只监听列表中的会话不会被写入。
+    """
+    matcher = KeywordMatcher([keyword], []) if match_type == 'exact' else KeywordMatcher([], [keyword])
+    since = time.time() - days * 86400
+    scanned = matched = inserted = 0
+    statements: List[Tuple[str, Tuple]] = []
+    began = time.monotonic()
+    snapshot = keyword_store.snapshot
+
+    for record in iter_archived(since, chat_id, directory):
+        scanned += 1
+        if snapshot.matcher_for(record['chat_id']) is None:
+            continue
+        text = record['text'] or record['caption']
+        if not text or record['sender_is_self']:
+            continue
+        if record['sender_id'] is not None and is_user_blocked(record['sender_id']):
+            continue
+        if not matcher.match(text):
+            continue
+
+        matched += 1
+        statements.extend(message_statements(
+            client_id=record['client_id'],
+            chat_id=record['chat_id'],
+            chat_title=record['chat_title'] or str(record['chat_id']),
+            chat_type=record['chat_type'],
+            chat_username=record['chat_username'],
+            sender_id=record['sender_id'],
+            sender_username=record['sender_username'],
+            sender_name=record['sender_name'],
+            message_id=record['message_id'],
+            message_text=text,
+            matched_keyword=keyword,
+            match_type=match_type,
+            message_date=datetime.fromtimestamp(record['date'] or record['recv']),
+            is_pushed=True,
+            keep_metadata=True
+        ))
+        if len(statements) >= BACKFILL_BATCH_SIZE:
+            inserted += _flush(statements)
+    inserted += _flush(statements)
+
+    logger.info(
+        f"关键词回溯完成[{match_type}]: {keyword}，最近 {days} 天扫描 {scanned} 条，"
+        f"命中 {matched} 条，新增 {inserted} 条，耗时 {time.monotonic() - began:.1f}s"
+    )
+    return scanned, matched, inserted
+
+
+def prune(days: int = RAW_ARCHIVE_DAYS, directory: Path = RECORD_DIR) -> int:
+    """删除超过保留天数的分段和每日索引，返回删除的分段数"""
+    if days <= 0 or not directory.exists():
+        return 0
+    cutoff = time.time() - days * 86400
+    removed = 0
+    for path, summary in _segments(directory):
+        # 没有索引的分段（写入中或崩溃留下的）按修改时间判断
+        last = summary['last'] if summary else path.stat().st_mtime
+        if last >= cutoff:
+            continue
+        path.unlink(missing_ok=True)
+        index_path(path).unlink(missing_ok=True)
+        removed += 1
+
+    cutoff_day = datetime.fromtimestamp(cutoff).date()
+    for cache in (directory / 'index').glob('*.json'):
+        if date.fromisoformat(cache.stem) < cutoff_day:
+            cache.unlink(missing_ok=True)
+
+    if removed:
+        logger.info(f"已删除 {removed} 个超过 {days} 天的原始消息分段")
+    return removed
@@ -0,0 +1,218 @@
+import os
+import gzip
+import json
+import time
+import heapq
+import queue
+import logging
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from config import RECORD_DIR, RECORD_SEGMENT_SECONDS
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 写线程的停止信号
+_STOP = object()
+
+# 分段文件后缀，写入中的分段额外带 .part，关闭后改名
+SEGMENT_SUFFIX = '.jsonl.gz'
+PART_SUFFIX = '.part'
+
+
+def message_record(client, message) -> Dict:
+    """把一条群消息转换为录制格式
+
+    recv 收到的时间戳，client/client_id 监听号，chat_* 会话，
+    sender_* 发送者，text/caption 文本，date 消息时间戳。
+    """
+    chat = message.chat
+    sender = message.from_user
+    return {
+        'recv': time.time(),
+        'client': client.name,
+        'client_id': client.me.id,
+        'chat_id': chat.id,
+        'chat_type': chat.type.value,
+        'chat_title': chat.title,
+        'chat_username': getattr(chat, 'username', None),
+        'message_id': message.id,
+        'sender_id': sender.id if sender else None,
+        'sender_username': sender.username if sender else None,
+        'sender_name': sender.full_name if sender else None,
+        'sender_is_self': bool(sender and sender.is_self),
+        'text': message.text,
+        'caption': message.caption,
+        'date': message.date.timestamp() if message.date else None,
+    }
+
+
+class Recorder:
+    """群消息录制
+
+    开启后 on_group_message 把每条消息放入有界队列，由写线程追加到
+    gzip 压缩的 JSONL 分段文件中，每 segment_seconds 秒换一个新文件。
+    队列满时直接丢弃，不影响正常的消息处理。
+    """
+
+    def __init__(self, directory: Path, segment_seconds: float, max_queue: int = 10000):
+        self.directory = Path(directory)
+        self.segment_seconds = segment_seconds
+        self.enabled = False
+        self.dropped = 0
+        self._segments = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """开始录制"""
+        if self._thread and self._thread.is_alive():
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+        self.enabled = True
+        logger.info(f"消息录制已开启: {self.directory}")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """写完队列中剩余的记录并关闭当前分段"""
+        thread = self._thread
+        if not thread:
+            return
+        self.enabled = False
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        self._thread = None
+        if self.dropped:
+            logger.warning(f"录制队列已满，共丢弃 {self.dropped} 条")
+
+    def record(self, client, message) -> None:
+        """录制一条消息"""
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(message_record(client, message))
+        except queue.Full:
+            self.dropped += 1
+
+    def _segment_path(self) -> Path:
+        # 带上进程号和序号，分片模式下多个进程可以写同一个目录
+        self._segments += 1
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._segments:04d}{SEGMENT_SUFFIX}"
+        return self.directory / name
+
+    def _close_segment(self, segment, part: Path, path: Path, summary: Dict) -> None:
+        """关闭分段并改名，同时写入该分段的会话索引"""
+        segment.close()
+        os.replace(part, path)
+        index = index_path(path)
+        with open(index.with_name(index.name + PART_SUFFIX), 'w', encoding='utf-8') as f:
+            json.dump(summary, f)
+        os.replace(index.with_name(index.name + PART_SUFFIX), index)
+
+    def _run(self) -> None:
+        path = part = None
+        segment = None
+        summary: Dict = {}
+        deadline = 0.0
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=max(0.1, deadline - time.monotonic()) if segment else None)
+                except queue.Empty:
+                    item = None
+
+                # 分段到期时关闭并改名，之后不再修改
+                if segment is not None and time.monotonic() >= deadline:
+                    self._close_segment(segment, part, path, summary)
+                    segment = None
+
+                if item is _STOP:
+                    break
+                if item is None:
+                    continue
+
+                if segment is None:
+                    path = self._segment_path()
+                    part = path.with_name(path.name + PART_SUFFIX)
+                    segment = gzip.open(part, 'wt', encoding='utf-8', compresslevel=6)
+                    summary = {'first': item['recv'], 'last': item['recv'], 'chats': {}}
+                    deadline = time.monotonic() + self.segment_seconds
+                segment.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+                segment.write('\n')
+                summary['last'] = item['recv']
+                chats = summary['chats']
+                chats[item['chat_id']] = chats.get(item['chat_id'], 0) + 1
+        except Exception as e:
+            logger.error(f"消息录制失败: {e}")
+            self.enabled = False
+        finally:
+            if segment is not None:
+                self._close_segment(segment, part, path, summary)
+
+
+def index_path(path: Path) -> Path:
+    """分段对应的索引文件：收到时间范围和每个会话的消息数"""
+    return path.with_name(path.name[:-len(SEGMENT_SUFFIX)] + '.idx.json')
+
+
+def read_index(path: Path) -> Optional[Dict]:
+    """读取分段索引，写入中或崩溃留下的分段没有索引，返回 None"""
+    try:
+        with open(index_path(path), encoding='utf-8') as f:
+            summary = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    summary['chats'] = {int(chat_id): count for chat_id, count in summary['chats'].items()}
+    return summary
+
+
+def segment_paths(paths: Iterable[Path]) -> List[Path]:
+    """展开目录，返回按文件名（即开始时间）排序的分段文件"""
+    result = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            result.extend(path.glob(f'*{SEGMENT_SUFFIX}'))
+            result.extend(path.glob(f'*{SEGMENT_SUFFIX}{PART_SUFFIX}'))
+        else:
+            result.append(path)
+    return sorted(result, key=lambda p: p.name)
+
+
+def read_segment(path: Path) -> Iterator[Dict]:
+    """逐条读取一个分段，进程崩溃留下的不完整分段读到损坏处为止"""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # 截断的最后一行
+                    return
+    except (EOFError, OSError, zlib.error) as e:
+        logger.warning(f"分段 {path.name} 不完整: {e}")
+
+
+def _read_chain(paths: List[Path]) -> Iterator[Dict]:
+    for path in paths:
+        yield from read_segment(path)
+
+
+def read_records(paths: Iterable[Path]) -> Iterator[Dict]:
+    """读取多个分段，按收到时间合并排序
+
+    同一进程的分段按顺序首尾相接，只在不同进程之间归并，同时打开的文件数等于进程数。
+    """
+    by_process: Dict[str, List[Path]] = {}
+    for path in segment_paths(paths):
+        parts = path.name.split('-')
+        process = parts[2] if len(parts) > 3 else path.name
+        by_process.setdefault(process, []).append(path)
+    return heapq.merge(*(_read_chain(group) for group in by_process.values()), key=lambda r: r['recv'])
+
+
+# 全局录制器
+recorder = Recorder(RECORD_DIR, RECORD_SEGMENT_SECONDS)
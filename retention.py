@@ -0,0 +1,222 @@
+"""数据保留与归档
+
+已推送且超过 RETENTION_DAYS 天的消息按消息日期追加到
+ARCHIVE_DIR/YYYY/MM/messages-YYYY-MM-DD.jsonl.gz，再分小批从数据库删除，
+每批之后执行 incremental_vacuum 回收空间。
+
+命令行用法（在项目根目录执行）：
+    python retention.py run [--days 90]                    # 立即执行一次归档
+    python retention.py query --since 2024-01-01 --text 出售  # 查询归档
+    python retention.py vacuum [--full]                    # 回收空间，--full 会转换为增量回收模式
+"""
+import os
+import gzip
+import json
+import time
+import zlib
+import logging
+import argparse
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from config import (
+    ARCHIVE_DIR, RETENTION_DAYS,
+    RETENTION_BATCH_SIZE, RETENTION_PAUSE, VACUUM_PAGES
+)
+from db import MESSAGE_JOINS, message_select, read_conn, write_conn, get_conn
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 可以归档的消息：已拆分为推送任务，且没有仍在推送中的任务；
+# 归档中的每条记录带上会话和发送者信息，不依赖数据库中的 chats、senders 表
+ARCHIVABLE_SQL = f'''
+    SELECT {message_select()} FROM messages m INDEXED BY idx_messages_date {MESSAGE_JOINS}
+    WHERE m.message_date < ? AND (m.message_date, m.id) > (?, ?)
+      AND m.is_pushed = 1
+      AND NOT EXISTS (
+          SELECT 1 FROM deliveries d
+          WHERE d.message_rowid = m.id AND d.state IN ('pending', 'claimed')
+      )
+    ORDER BY m.message_date, m.id
+    LIMIT ?
+'''
+
+
+def archive_path(day: str, archive_dir: Path = ARCHIVE_DIR) -> Path:
+    """某一天的归档文件路径，day 格式为 YYYY-MM-DD"""
+    return archive_dir / day[:4] / day[5:7] / f"messages-{day}.jsonl.gz"
+
+
+def _append_archive(path: Path, rows: List[Dict]) -> None:
+    """追加到归档文件并落盘；每次追加是一个独立的 gzip 成员，读取时自动拼接"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='ab', compresslevel=6) as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')).encode())
+                f.write(b'\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def _delete_batch(ids: List[int], rows: List[Dict]) -> None:
+    """在一个短事务中删除一批已归档的消息及其推送记录"""
+    with write_conn() as conn:
+        conn.executemany('DELETE FROM deliveries WHERE message_rowid = ?', [(i,) for i in ids])
+        conn.executemany(
+            'DELETE FROM message_sightings WHERE chat_id = ? AND message_id = ? AND dedup_scope = ?',
+            [(row['chat_id'], row['message_id'], row['dedup_scope']) for row in rows]
+        )
+        conn.executemany('DELETE FROM messages WHERE id = ?', [(i,) for i in ids])
+
+
+def incremental_vacuum(pages: int = VACUUM_PAGES) -> None:
+    """回收最多 pages 个空闲页（数据库不是增量回收模式时没有效果）"""
+    with write_conn() as conn:
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+
+
+def run_retention(days: int = RETENTION_DAYS, archive_dir: Path = ARCHIVE_DIR,
+                  batch_size: int = RETENTION_BATCH_SIZE, pause: float = RETENTION_PAUSE) -> int:
+    """归档并删除超过保留天数的已推送消息，返回处理的条数
+
+    先写归档再删除：中途崩溃时，已写入归档但未删除的消息下次会再归档一次，
+    查询归档时按 id 去重。
+    """
+    if days <= 0:
+        return 0
+
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    last_date, last_id = '', 0
+    total = 0
+    began = time.monotonic()
+
+    while True:
+        with read_conn() as conn:
+            cursor = conn.execute(ARCHIVABLE_SQL, (cutoff, last_date, last_id, batch_size))
+            columns = [description[0] for description in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        if not rows:
+            break
+        last_date, last_id = rows[-1]['message_date'], rows[-1]['id']
+
+        for day, items in groupby(rows, key=lambda row: row['message_date'][:10]):
+            _append_archive(archive_path(day, archive_dir), list(items))
+        _delete_batch([row['id'] for row in rows], rows)
+        incremental_vacuum()
+        total += len(rows)
+
+        # 让出写锁，避免长时间阻塞消息写入
+        time.sleep(pause)
+
+    if total:
+        logger.info(f"已归档 {total} 条超过 {days} 天的消息，耗时 {time.monotonic() - began:.1f}s")
+    return total
+
+
+def _read_archive(path: Path) -> Iterator[Dict]:
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    return
+    except (EOFError, OSError, zlib.error) as e:
+        logger.warning(f"归档文件 {path.name} 不完整: {e}")
+
+
+def iter_archive(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    keyword: Optional[str] = None,
+    chat_id: Optional[int] = None,
+    sender_id: Optional[int] = None,
+    text: Optional[str] = None,
+    archive_dir: Path = ARCHIVE_DIR
+) -> Iterator[Dict]:
+    """按日期顺序查询归档的消息，只打开日期范围内的分区文件"""
+    text = text.lower() if text else None
+    for path in sorted(archive_dir.glob('*/*/messages-*.jsonl.gz')):
+        day = date.fromisoformat(path.name[len('messages-'):-len('.jsonl.gz')])
+        if (since and day < since) or (until and day > until):
+            continue
+
+        seen = set()
+        for row in _read_archive(path):
+            if row['id'] in seen:
+                continue
+            seen.add(row['id'])
+            if keyword and row['matched_keyword'] != keyword:
+                continue
+            if chat_id and row['chat_id'] != chat_id:
+                continue
+            if sender_id and row['sender_id'] != sender_id:
+                continue
+            if text and text not in (row['message_text'] or '').lower():
+                continue
+            yield row
+
+
+def vacuum(full: bool = False) -> None:
+    """回收空间；full 时切换为增量回收模式并执行完整 VACUUM（会锁库，需停机执行）"""
+    if not full:
+        with write_conn() as conn:
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+        return
+
+    conn = get_conn()
+    conn.isolation_level = None
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        logger.info(f"VACUUM 完成，auto_vacuum = {mode}")
+    finally:
+        conn.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="立即执行一次归档")
+    run.add_argument("--days", type=int, default=RETENTION_DAYS or None, required=not RETENTION_DAYS,
+                     help="保留天数，默认使用 RETENTION_DAYS")
+
+    query = commands.add_parser("query", help="查询归档")
+    query.add_argument("--since", type=date.fromisoformat, help="开始日期 YYYY-MM-DD")
+    query.add_argument("--until", type=date.fromisoformat, help="结束日期 YYYY-MM-DD")
+    query.add_argument("--keyword", help="匹配到的关键词")
+    query.add_argument("--chat-id", type=int)
+    query.add_argument("--sender-id", type=int)
+    query.add_argument("--text", help="消息文本包含的内容")
+    query.add_argument("--limit", type=int, default=100)
+    query.add_argument("--json", action="store_true", help="以 JSON Lines 输出完整记录")
+
+    vac = commands.add_parser("vacuum", help="回收数据库空间")
+    vac.add_argument("--full", action="store_true", help="转换为增量回收模式并执行完整 VACUUM")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run_retention(days=args.days)
+    elif args.command == "vacuum":
+        vacuum(full=args.full)
+    elif args.command == "query":
+        rows = iter_archive(args.since, args.until, args.keyword, args.chat_id, args.sender_id, args.text)
+        for i, row in enumerate(rows):
+            if i >= args.limit:
+                break
+            if args.json:
+                print(json.dumps(row, ensure_ascii=False))
+            else:
+                print(f"{row['message_date']} [{row['matched_keyword']}] {row['chat_title']} - "
+                      f"{row['sender_name'] or '未知'}: {(row['message_text'] or '')[:80]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import time
+import queue
+import signal
+import zlib
+import logging
+import asyncio
+import multiprocessing
+from typing import List, Optional, Tuple
+
+from config import SHARDS, SHARD_QUEUE_SIZE, METRICS_HOST, METRICS_PORT, RECORD_UPDATES
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 主进程检查工作进程是否存活的间隔
+SHARD_CHECK_INTERVAL = 5
+# 主进程一次最多取出的匹配结果数量
+SHARD_DRAIN_BATCH = 500
+# 停止时等待工作进程退出的时间
+SHARD_STOP_TIMEOUT = 60
+# 工作进程向主进程上报采集指标的间隔（/stats 在主进程中汇总）
+SHARD_METRICS_INTERVAL = 5
+
+
+def shard_of(phone: str, shards: int) -> int:
+    """监听号所属的分片，同一个手机号在各进程、各次启动中结果一致"""
+    return zlib.crc32(phone.encode()) % shards
+
+
+async def _worker_main(index: int, shards: int, matches, control) -> None:
+    # 在子进程中导入，避免主进程的连接和线程被带入
+    from db import remember_blocked
+    from ingest import forward_to
+    from keywords import keyword_store
+    from supervisor import supervisor
+    from recorder import recorder
+    import metrics
+
+    loop = asyncio.get_running_loop()
+
+    async def send(item: Tuple) -> None:
+        try:
+            matches.put_nowait(item)
+        except queue.Full:
+            # 主进程处理不过来时阻塞在线程池里，不阻塞事件循环
+            await loop.run_in_executor(None, matches.put, item)
+
+    # 匹配结果全部发给主进程写库
+    forward_to(send)
+    keyword_store.load()
+    if RECORD_UPDATES:
+        recorder.start()
+    supervisor.phone_filter = lambda phone: shard_of(phone, shards) == index
+    supervisor_task = asyncio.create_task(supervisor.run())
+    logger.info(f"分片 {index}/{shards} 已启动")
+
+    async def report_metrics() -> None:
+        while True:
+            await asyncio.sleep(SHARD_METRICS_INTERVAL)
+            await send(('metrics', index, metrics.export(metrics.SHARD_METRICS)))
+
+    report_task = asyncio.create_task(report_metrics())
+
+    # 每个分片使用主进程指标端口之后的端口
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT + 1 + index)
+
+    try:
+        while True:
+            command = await loop.run_in_executor(None, control.get)
+            kind = command[0]
+            if kind == 'stop':
+                break
+            elif kind == 'sessions':
+                supervisor.notify()
+            elif kind == 'keywords':
+                keyword_store.load()
+            elif kind == 'block':
+                remember_blocked(command[1])
+            else:
+                logger.warning(f"未知的控制命令: {kind}")
+    finally:
+        report_task.cancel()
+        supervisor_task.cancel()
+        try:
+            await supervisor_task
+        except asyncio.CancelledError:
+            pass
+        await supervisor.shutdown()
+        recorder.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        logger.info(f"分片 {index} 的监听号已停止")
+
+
+def run_worker(index: int, shards: int, matches, control) -> None:
+    """工作进程入口：只运行本分片的监听号和关键词匹配"""
+    # Ctrl+C 由主进程处理，再通过控制队列通知工作进程退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"[shard-{index}] %(levelname)s:%(name)s:%(message)s")
+    asyncio.run(_worker_main(index, shards, matches, control))
+
+
+class ShardCoordinator:
+    """多进程分片的主进程端
+
+    按手机号把 sessions.json 中的监听号分散到 shards 个工作进程，
+    每个进程运行自己的客户端和匹配器；匹配结果经队列发回主进程，
+    由主进程统一去重、写库和推送，采集指标也定期经同一队列上报，供 /stats 汇总。监听号、关键词和黑名单的变化通过控制队列广播。
+    """
+
+    def __init__(self, shards: int = SHARDS, queue_size: int = SHARD_QUEUE_SIZE):
+        self.shards = shards
+        # 使用 spawn 启动，子进程不继承主进程的数据库连接和线程
+        self._context = multiprocessing.get_context('spawn')
+        self._matches = self._context.Queue(queue_size)
+        self._controls = [self._context.Queue() for _ in range(shards)]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * shards
+        self._stopping = False
+        self._last_check = 0.0
+
+    def _start_worker(self, index: int) -> None:
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, self.shards, self._matches, self._controls[index]),
+            name=f"shard-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info(f"分片进程 {index} 已启动 (pid {process.pid})")
+
+    def start(self) -> None:
+        """启动所有工作进程"""
+        for index in range(self.shards):
+            self._start_worker(index)
+
+    def broadcast(self, command: Tuple) -> None:
+        """向所有工作进程发送控制命令"""
+        for control in self._controls:
+            control.put(command)
+
+    def _check_workers(self) -> None:
+        """重启意外退出的工作进程"""
+        now = time.monotonic()
+        if self._stopping or now - self._last_check < SHARD_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                logger.error(f"分片进程 {index} 意外退出 (exitcode {process.exitcode})，正在重启")
+                self._start_worker(index)
+
+    def _drain(self, timeout: float) -> List[Tuple]:
+        """取出一批匹配结果，队列为空时最多等待 timeout 秒"""
+        items = []
+        try:
+            items.append(self._matches.get(timeout=timeout))
+            while len(items) < SHARD_DRAIN_BATCH:
+                items.append(self._matches.get_nowait())
+        except queue.Empty:
+            pass
+        return items
+
+    async def _submit(self, items: List[Tuple]) -> None:
+        from ingest import submit_forwarded
+        import metrics
+        for item in items:
+            try:
+                if item[0] == 'metrics':
+                    metrics.import_remote(item[1], item[2])
+                    continue
+                await submit_forwarded(item)
+            except Exception as e:
+                logger.error(f"处理分片匹配结果失败: {e}")
+
+    async def run(self) -> None:
+        """接收工作进程的匹配结果，交给本进程的写入队列，stop() 开始后处理完当前一批即退出
+
+        不能直接取消：线程池中的 _drain 不会随之停止，已经取出的匹配结果会丢失。
+        """
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            items = await loop.run_in_executor(None, self._drain, 1.0)
+            await self._submit(items)
+            self._check_workers()
+
+    async def stop(self, runner: Optional[asyncio.Task] = None) -> None:
+        """通知工作进程退出，并处理它们退出前发来的剩余结果
+
+        runner 为运行 run() 的任务，先等它处理完正在取出的一批再接管队列。
+        """
+        self._stopping = True
+        if runner is not None:
+            try:
+                await runner
+            except Exception as e:
+                logger.error(f"分片接收循环异常退出: {e}")
+        self.broadcast(('stop',))
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + SHARD_STOP_TIMEOUT
+
+        # 子进程要等队列数据发送完才能退出，所以边等边取
+        while any(p is not None and p.is_alive() for p in self._processes) and time.monotonic() < deadline:
+            await self._submit(await loop.run_in_executor(None, self._drain, 0.2))
+
+        for index, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                logger.warning(f"分片进程 {index} 未按时退出，强制结束")
+                process.terminate()
+                process.join(5)
+
+        while True:
+            items = await loop.run_in_executor(None, self._drain, 0)
+            if not items:
+                break
+            await self._submit(items)
+        logger.info("所有分片进程已停止")
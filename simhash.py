@@ -0,0 +1,105 @@
+import re
+import time
+from collections import deque
+from hashlib import blake2b
+from typing import Deque, Dict, Hashable, List, Optional, Set, Tuple
+
+# 去掉链接、@用户名，以及数字、标点和空白，只保留文字
+_NOISE_RE = re.compile(r'https?://\S+|t\.me/\S+|@\w+')
+_NON_TEXT_RE = re.compile(r'[\W\d_]+')
+
+FINGERPRINT_BITS = 64
+
+
+def normalize(text: str) -> str:
+    """归一化文本，轻微改动（换链接、加空格、改数字）后结果不变"""
+    text = _NOISE_RE.sub('', text.lower())
+    return _NON_TEXT_RE.sub('', text)
+
+
+def shingles(text: str, size: int = 3) -> Set[str]:
+    """按字符切分的 n-gram 集合，中文没有空格分词，按字符切分更稳定"""
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def simhash(text: str) -> int:
+    """计算归一化文本的 64 位 SimHash 指纹"""
+    weights = [0] * FINGERPRINT_BITS
+    for shingle in shingles(text):
+        h = int.from_bytes(blake2b(shingle.encode(), digest_size=8).digest(), 'little')
+        for bit in range(FINGERPRINT_BITS):
+            if h >> bit & 1:
+                weights[bit] += 1
+            else:
+                weights[bit] -= 1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class SimHashIndex:
+    """近似重复检测索引
+
+    指纹按位平均分成 max_distance + 1 段，两个指纹的汉明距离不超过 max_distance 时
+    至少有一段完全相同，因此只需比较至少一段相同的候选。
+    超过 window 秒的指纹自动过期。
+    """
+
+    def __init__(self, max_distance: int, window: float):
+        self.max_distance = max_distance
+        self.window = window
+        self.bands = max_distance + 1
+        self._band_bits = FINGERPRINT_BITS // self.bands
+        self._band_mask = (1 << self._band_bits) - 1
+        # (段序号, 段值) -> [(指纹, 键)]
+        self._buckets: Dict[Tuple[int, int], List[Tuple[int, Hashable]]] = {}
+        # 按加入时间排序，用于过期清理
+        self._entries: Deque[Tuple[float, int, Hashable]] = deque()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _bands(self, fingerprint: int):
+        for band in range(self.bands):
+            yield band, fingerprint >> (band * self._band_bits) & self._band_mask
+
+    def _expire(self, now: float) -> None:
+        entries = self._entries
+        while entries and entries[0][0] <= now:
+            _, fingerprint, key = entries.popleft()
+            for band_key in self._bands(fingerprint):
+                bucket = self._buckets.get(band_key)
+                if bucket is None:
+                    continue
+                try:
+                    bucket.remove((fingerprint, key))
+                except ValueError:
+                    pass
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def find(self, fingerprint: int) -> Optional[Hashable]:
+        """查找窗口内的近似重复，返回第一个命中的键（不一定是最早加入的）"""
+        self._expire(time.monotonic())
+        for band_key in self._bands(fingerprint):
+            for candidate, key in self._buckets.get(band_key, ()):
+                if hamming(fingerprint, candidate) <= self.max_distance:
+                    return key
+        return None
+
+    def add(self, fingerprint: int, key: Hashable) -> None:
+        """加入一个指纹"""
+        now = time.monotonic()
+        self._expire(now)
+        self._entries.append((now + self.window, fingerprint, key))
+        for band_key in self._bands(fingerprint):
+            self._buckets.setdefault(band_key, []).append((fingerprint, key))
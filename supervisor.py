@@ -0,0 +1,262 @@
+import time
+import random
+import logging
+import asyncio
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from pyrogram import Client, raw
+from config import (
+    API_ID, API_HASH,
+    SESSIONS_FILE, load_json,
+    CLIENT_START_CONCURRENCY, CLIENT_RETRY_BASE, CLIENT_RETRY_MAX,
+    CLIENT_LIVENESS_INTERVAL, CLIENT_PING_IDLE, CLIENT_PING_TIMEOUT, CLIENT_STALL_TIMEOUT
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+CLIENT_STOP_TIMEOUT = 30
+
+
+def session_name(phone: str) -> str:
+    """监听号对应的会话名称（data/ 下的 .session 文件名）"""
+    return f"user_{phone.replace('+', '')}"
+
+
+class SessionSupervisor:
+    """监听号管理
+
+    机器人增删监听号后调用 notify()，立即按 sessions.json 启动或停止客户端；
+    同时定期检查每个客户端最后收到更新的时间，空闲过久先 ping 一次，
+    连接断开、ping 失败或停滞超时的客户端自动重启。
+    """
+
+    def __init__(self, phone_filter: Optional[Callable[[str], bool]] = None):
+        # 只管理 phone_filter 返回 True 的监听号（多进程分片时使用）
+        self.phone_filter = phone_filter
+        self.active_clients: Dict[str, Client] = {}
+        # 启动失败的监听号：手机号 -> (连续失败次数, 下次可重试的时间)
+        self._failures: Dict[str, Tuple[int, float]] = {}
+        # 会话名称 -> 最后收到更新的时间
+        self._last_update: Dict[str, float] = {}
+        self._restarting: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._last_liveness_check = 0.0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # sessions.json 变化后的回调（分片模式下用于通知工作进程）
+        self.on_notify: Optional[Callable[[], None]] = None
+
+    def notify(self) -> None:
+        """sessions.json 已变化，唤醒监听号管理，可在任意线程中调用"""
+        if self.on_notify is not None:
+            self.on_notify()
+        if self._loop is None or self._wakeup is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def touch(self, name: str) -> None:
+        """记录客户端收到了更新"""
+        self._last_update[name] = time.monotonic()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """限制同时启动/停止的监听号数量"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(CLIENT_START_CONCURRENCY)
+        return self._semaphore
+
+    def _record_start_failure(self, phone: str) -> float:
+        """记录一次启动失败，返回带抖动的指数退避秒数"""
+        failures = self._failures.get(phone, (0, 0.0))[0] + 1
+        delay = min(CLIENT_RETRY_MAX, CLIENT_RETRY_BASE * 2 ** (failures - 1))
+        # 一半固定、一半随机，避免大量账号同时重试
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self._failures[phone] = (failures, time.monotonic() + delay)
+        return delay
+
+    async def start_client(self, phone: str, name: str = None) -> bool:
+        """启动单个客户端"""
+        if phone in self.active_clients:
+            logger.warning(f"监听号 {phone} 已经在运行中")
+            return True
+
+        queued_at = time.monotonic()
+        client = None
+        async with self._get_semaphore():
+            started_at = time.monotonic()
+            try:
+                client = Client(
+                    name=session_name(phone),
+                    api_id=API_ID,
+                    api_hash=API_HASH,
+                    workdir="data",
+                    plugins=dict(root="user")
+                )
+                await client.start()
+                self.active_clients[phone] = client
+                self._failures.pop(phone, None)
+                self.touch(client.name)
+                logger.info(
+                    f"监听号 {phone} ({name or '未命名'}) 已启动，"
+                    f"排队 {started_at - queued_at:.2f}s，连接与同步 {time.monotonic() - started_at:.2f}s"
+                )
+                return True
+            except Exception as e:
+                delay = self._record_start_failure(phone)
+                logger.error(
+                    f"启动监听号 {phone} 失败（耗时 {time.monotonic() - started_at:.2f}s）: {str(e)}，"
+                    f"{delay:.0f} 秒后重试"
+                )
+                if client and client.is_connected:
+                    try:
+                        await client.disconnect()
+                    except Exception:
+                        pass
+                return False
+
+    async def stop_client(self, phone: str) -> bool:
+        """停止单个客户端"""
+        if phone not in self.active_clients:
+            logger.warning(f"监听号 {phone} 未在运行")
+            return True
+
+        async with self._get_semaphore():
+            client = self.active_clients.pop(phone)
+            self._last_update.pop(client.name, None)
+            try:
+                # 连接异常时 stop 可能长时间卡住，超时后直接丢弃该客户端
+                await asyncio.wait_for(client.stop(), CLIENT_STOP_TIMEOUT)
+                logger.info(f"监听号 {phone} 已停止")
+                return True
+            except Exception as e:
+                logger.error(f"停止监听号 {phone} 失败: {str(e)}")
+                return False
+
+    async def restart_client(self, phone: str, reason: str) -> None:
+        """重启一个连接异常的客户端"""
+        if phone in self._restarting:
+            return
+        self._restarting.add(phone)
+        try:
+            logger.warning(f"监听号 {phone} {reason}，正在重启")
+            began = time.monotonic()
+            await self.stop_client(phone)
+            if await self.start_client(phone):
+                logger.info(f"监听号 {phone} 重启完成，耗时 {time.monotonic() - began:.2f}s")
+            else:
+                # 启动失败交给 reconcile 按退避时间重试
+                self.notify()
+        finally:
+            self._restarting.discard(phone)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def reconcile(self) -> None:
+        """按 sessions.json 并发启动新增的、停止已删除的监听号"""
+        try:
+            # 读取当前配置的监听号
+            sessions = load_json(SESSIONS_FILE, default=[])
+            configured_phones = {
+                s['phone']: s.get('name') for s in sessions
+                if self.phone_filter is None or self.phone_filter(s['phone'])
+            }
+            active_phones = set(self.active_clients.keys()) - self._restarting
+            now = time.monotonic()
+
+            # 停止已删除的监听号
+            removed = active_phones - configured_phones.keys()
+            for phone in set(self._failures) - configured_phones.keys():
+                self._failures.pop(phone, None)
+
+            # 启动新添加的监听号，启动失败的等退避时间到了再重试
+            to_start = {
+                phone: name for phone, name in configured_phones.items()
+                if phone not in self.active_clients and phone not in self._restarting
+                and self._failures.get(phone, (0, 0.0))[1] <= now
+            }
+            if not removed and not to_start:
+                return
+
+            began = time.monotonic()
+            results = await asyncio.gather(
+                *(self.stop_client(phone) for phone in removed),
+                *(self.start_client(phone, name) for phone, name in to_start.items())
+            )
+            started = sum(results[len(removed):])
+            logger.info(
+                f"监听号状态同步完成：停止 {len(removed)} 个，启动成功 {started} 个，"
+                f"失败 {len(to_start) - started} 个，总耗时 {time.monotonic() - began:.2f}s"
+            )
+
+        except Exception as e:
+            logger.error(f"检查监听号状态失败: {str(e)}")
+
+    async def _check_client(self, phone: str, client: Client, now: float) -> None:
+        """检查单个客户端是否还在正常接收更新"""
+        idle = now - self._last_update.get(client.name, now)
+        if not client.is_connected:
+            reason = "连接已断开"
+        elif idle >= CLIENT_STALL_TIMEOUT:
+            reason = f"已有 {idle:.0f} 秒没有收到更新"
+        elif idle >= CLIENT_PING_IDLE:
+            try:
+                await asyncio.wait_for(
+                    client.invoke(raw.functions.Ping(ping_id=random.getrandbits(63))),
+                    CLIENT_PING_TIMEOUT
+                )
+                return
+            except Exception as e:
+                reason = f"ping 失败（{type(e).__name__}）"
+        else:
+            return
+        self._spawn(self.restart_client(phone, reason))
+
+    async def check_liveness(self) -> None:
+        """每隔 CLIENT_LIVENESS_INTERVAL 秒检查一次所有客户端"""
+        now = time.monotonic()
+        if now - self._last_liveness_check < CLIENT_LIVENESS_INTERVAL:
+            return
+        self._last_liveness_check = now
+        await asyncio.gather(*(
+            self._check_client(phone, client, now)
+            for phone, client in list(self.active_clients.items())
+            if phone not in self._restarting
+        ))
+
+    def _next_timeout(self) -> float:
+        """到下一次存活检查或退避重试的秒数"""
+        now = time.monotonic()
+        deadline = self._last_liveness_check + CLIENT_LIVENESS_INTERVAL
+        for _, retry_at in self._failures.values():
+            deadline = min(deadline, retry_at)
+        return max(1.0, deadline - now)
+
+    async def run(self) -> None:
+        """监听号管理主循环"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._last_liveness_check = time.monotonic()
+
+        while True:
+            await self.reconcile()
+            await self.check_liveness()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._next_timeout())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def shutdown(self) -> None:
+        """停止所有监听号"""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(*(self.stop_client(phone) for phone in list(self.active_clients.keys())))
+
+
+# 全局监听号管理
+supervisor = SessionSupervisor()
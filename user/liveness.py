@@ -0,0 +1,9 @@
+from pyrogram import Client
+
+from supervisor import supervisor
+
+
+@Client.on_raw_update(group=-1)
+async def on_any_update(client: Client, update, users, chats):
+    """记录监听号最后收到更新的时间，用于存活检查"""
+    supervisor.touch(client.name)
@@ -1,4 +1,5 @@
 import os
+import time
 from typing import Optional, List, Dict, Tuple
 
 from pyrogram import Client, filters, types, helpers, errors, enums
@@ -7,42 +8,40 @@ from config import (
     API_ID, API_HASH, BOT_TOKEN,
     SESSIONS_FILE, KEYWORDS_FILE, load_json, save_json
 )
-from db import save_message
+from db import is_user_blocked
+from ingest import seen_messages, message_key, submit_match, submit_sighting
+from keywords import keyword_store
+from matcher import Matcher
+import metrics
+from recorder import recorder
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_keywords() -> Tuple[List[str], List[str]]:
-    """获取关键词列表，返回 (精确匹配列表, 模糊匹配列表)"""
-    keywords = load_json(KEYWORDS_FILE, default={"exact": [], "fuzzy": []})
-    return keywords.get("exact", []), keywords.get("fuzzy", [])
-
-def match_keywords(text: str) -> Optional[Tuple[str, str]]:
+def match_keywords(text: str, matcher: Optional[Matcher] = None) -> Optional[Tuple[str, str]]:
     """匹配关键词，返回 (匹配到的关键词, 匹配模式)"""
     if not text:
         return None
-        
-    text = text.lower()
-    exact_keywords, fuzzy_keywords = get_keywords()
-    
-    # 1. 先尝试精确匹配
-    for keyword in exact_keywords:
-        if keyword.lower() == text:
-            return keyword, "exact"
-    
-    # 2. 再尝试模糊匹配
-    for keyword in fuzzy_keywords:
-        if keyword.lower() in text:
-            return keyword, "fuzzy"
-    
-    return None
+
+    if matcher is None:
+        matcher = keyword_store.snapshot.matcher
+    return matcher.match(text)
 
 @Client.on_message(filters.group | filters.channel)
 async def on_group_message(client:Client, message: types.Message):
     """群组消息处理"""
-    # 忽略自己的消息
-    if message.from_user and message.from_user.is_self:
+    metrics.messages_seen.inc((client.name,))
+    recorder.record(client, message)
+
+    # 先按会话规则过滤，忽略的会话连文本都不提取
+    snapshot = keyword_store.snapshot
+    matcher = snapshot.matcher_for(message.chat.id)
+    if matcher is None:
+        return
+
+    # 忽略自己的消息和黑名单用户的消息
+    if message.from_user and (message.from_user.is_self or is_user_blocked(message.from_user.id)):
         return
 
     # 获取消息文本
@@ -50,12 +49,25 @@ async def on_group_message(client:Client, message: types.Message):
     if not text:
         return
 
+    # 多个监听号在同一个群里会收到同一条消息，只匹配和保存一次
+    client_id = client.me.id
+    key = message_key(message.chat.id, message.id, message.chat.type.value, client_id)
+    seen = seen_messages.get(key)
+    if seen is not None:
+        if seen:
+            await submit_sighting(key, client_id)
+        return
+
     # 匹配关键词
-    match = match_keywords(text)
+    started = time.perf_counter()
+    match = match_keywords(text, matcher)
+    metrics.match_seconds.observe(time.perf_counter() - started)
+    seen_messages.put(key, match is not None)
     if not match:
         return
     
     keyword, match_type = match
+    metrics.messages_matched.inc((match_type,))
 
     # 保存匹配的消息
     chat_title = message.chat.title or str(message.chat.id)
@@ -72,9 +84,9 @@ async def on_group_message(client:Client, message: types.Message):
         sender_username = None
         sender_name = None
 
-    # 保存消息，如果已存在则跳过
-    if save_message(
-        client_id=client.me.id,
+    # 放入写入队列，重复的消息由数据库唯一约束忽略
+    await submit_match(dict(
+        client_id=client_id,
         chat_id=message.chat.id,
         chat_title=chat_title,
         chat_type=message.chat.type.value,
@@ -86,6 +98,6 @@ async def on_group_message(client:Client, message: types.Message):
         message_text=text,
         matched_keyword=keyword,
         match_type=match_type,
-        message_date=message.date
-    ):
-        logger.info(f"关键词匹配成功[{match_type}]: {chat_title} - {keyword} - {text[:5]}...")
\ No newline at end of file
+        message_date=message.date,
+        priority=snapshot.priority(keyword, match_type)
+    ))